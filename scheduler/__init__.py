@@ -3,3 +3,5 @@ from __future__ import absolute_import, unicode_literals
 from scheduler.celery import app as celery_app
 
 __all__ = ['celery_app']
+
+default_app_config = 'scheduler.apps.SchedulerConfig'
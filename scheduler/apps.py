@@ -1,6 +1,16 @@
 """Application configuration"""
 from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete
 
 
 class SchedulerConfig(AppConfig):
+    """Connects signals keeping the interval index of lessons current"""
     name = 'scheduler'
+
+    def ready(self):
+        # pylint: disable=import-outside-toplevel
+        from scheduler.interval_index import lesson_saved, lesson_deleted, schedule_state_saved
+        from scheduler.models import Lesson, ScheduleState
+        post_save.connect(lesson_saved, sender=Lesson)
+        post_delete.connect(lesson_deleted, sender=Lesson)
+        post_save.connect(schedule_state_saved, sender=ScheduleState)
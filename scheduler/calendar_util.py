@@ -1,11 +1,14 @@
 """Utilities for displaying calendars"""
 import datetime
 
+from django.conf import settings
+from django.core.cache import cache
 from django.db.models import QuerySet
 
 from scheduler.conflicts_checker import conflicts_diff
 from scheduler.forms import MassEditForm
-from scheduler.models import Lesson, Room, Group, Conflict, color_from_id
+from scheduler.models import Lesson, Room, Group, Conflict, ScheduleState, color_from_id
+from scheduler.task import refresh_queued_conflicts
 
 
 def get_start_date(lessons: QuerySet):
@@ -19,20 +22,31 @@ def get_start_date(lessons: QuerySet):
     return start_date.isoformat(timespec='seconds')
 
 
+def get_schedule_events(lessons: QuerySet) -> list:
+    """Returns list of tuples describing lessons as calendar events"""
+    return [(q.start_time.strftime("%Y-%m-%dT%H:%M:%S"),
+             q.end_time.strftime("%Y-%m-%dT%H:%M:%S"),
+             q.name,
+             Group.objects.filter(id=q.group_id)[:1].get().name,
+             Room.objects.filter(id=q.room_id)[:1].get().number,
+             (q.professor.name + " " + q.professor.surname),
+             q.room_color,
+             q.group_color,
+             q.id,
+             q.start_time.strftime("%H:%M") + "-" + q.end_time.strftime("%H:%M"))
+            for q in lessons]
+
+
 def generate_full_schedule_context():
-    """Returns context dict for full schedule"""
+    """
+    Returns context dict for full schedule
+    Events are cached until the next change of schedule version
+    """
     lessons_query = Lesson.objects.all()
-    lessons_list = [(q.start_time.strftime("%Y-%m-%dT%H:%M:%S"),
-                     q.end_time.strftime("%Y-%m-%dT%H:%M:%S"),
-                     q.name,
-                     Group.objects.filter(id=q.group_id)[:1].get().name,
-                     Room.objects.filter(id=q.room_id)[:1].get().number,
-                     (q.professor.name + " " + q.professor.surname),
-                     q.room_color,
-                     q.group_color,
-                     q.id,
-                     q.start_time.strftime("%H:%M") + "-" + q.end_time.strftime("%H:%M"))
-                    for q in lessons_query]
+    lessons_list = cache.get_or_set(
+        'full_schedule_events:{}'.format(ScheduleState.load().version),
+        lambda: get_schedule_events(lessons_query),
+        getattr(settings, 'SCHEDULE_CACHE_TIMEOUT', 300))
     context = {
         'events': lessons_list,
         'lessons': Lesson.objects.all(),
@@ -48,13 +62,21 @@ def generate_full_schedule_context():
 
 
 def generate_conflicts_context():
-    """Returns context dict for conflicts"""
-    conflicts_list = Conflict.objects.all()
+    """
+    Returns context dict for conflicts last stored, flagged when they are being recomputed,
+    queued recompute is started without waiting for quiet period
+    """
+    state = ScheduleState.load()
+    refresh_queued_conflicts(state)
+    conflicts_list = Conflict.objects.select_related(
+        'first_lesson__professor', 'first_lesson__room', 'first_lesson__group',
+        'second_lesson__professor', 'second_lesson__room', 'second_lesson__group')
     color = ''
     context = {
         'conflicts': conflicts_list,
         'conflicts_color': color,
-        'conflicts_flag': bool(conflicts_list)
+        'conflicts_flag': bool(conflicts_list),
+        'conflicts_recomputing': state.conflicts_version != state.version
     }
     return context
 
@@ -98,5 +120,6 @@ def generate_context_for_conflicts_report(past_conflicts, current_conflicts):
     context = {'removed_conflicts': removed_conflicts,
                'removed_conflicts_number': len(removed_conflicts),
                'new_conflicts_number': len(new_conflicts),
-               'new_conflicts': new_conflicts}
+               'new_conflicts': new_conflicts,
+               'new_conflicts_ids': {conflict.id for conflict in new_conflicts}}
     return context
@@ -1,8 +1,37 @@
 """module responsible for finding conflicts in database"""
-import copy
-from typing import List, Tuple
+import datetime
+import heapq
+import os
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from scheduler.models import Lesson, Conflict
+import django
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from scheduler.interval_index import intervals_overlap, get_index, lessons_changed
+from scheduler.models import Lesson, Conflict, ScheduleState
+
+# conflict type and Lesson field holding id of the resource which can't be shared
+CONFLICT_RESOURCES = (("PROFESSOR", "professor_id"),
+                      ("ROOM", "room_id"),
+                      ("GROUP", "group_id"))
+
+# number of conflicts inserted with a single query, unless CONFLICTS_BATCH_SIZE is set
+DEFAULT_BATCH_SIZE = 500
+
+# engine used by db_conflicts, unless CONFLICTS_ENGINE is set
+DEFAULT_ENGINE = 'python'
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# partitions given to every worker of parallel engine, so that big buckets don't stall one
+PARTITIONS_PER_WORKER = 4
 
 
 def are_overlapping(lesson1: Lesson, lesson2: Lesson) -> bool:
@@ -12,62 +41,459 @@ def are_overlapping(lesson1: Lesson, lesson2: Lesson) -> bool:
     :param lesson2: Lesson object retrieved from database
     :return: bool if lessons are conflicting
     """
-    if lesson1.start_time <= lesson2.start_time < lesson1.end_time:
-        return True
-    if lesson1.end_time >= lesson2.end_time > lesson1.start_time:
-        return True
-    if lesson1.start_time >= lesson2.start_time and lesson1.end_time <= lesson2.end_time:
-        return True
-    return False
+    return intervals_overlap(lesson1.start_time, lesson1.end_time,
+                             lesson2.start_time, lesson2.end_time)
 
 
-def check_lesson(index: int, lesson_list: List[Lesson]) -> List[Tuple[str, Lesson, Lesson, int]]:
+def overlapping_pairs(intervals: Iterable[Tuple[Any, Any, Any]]) -> Iterator[Tuple[Any, Any]]:
     """
-    This function searches db for other lessons sharing the same professor, room and group
-    And then checks if they are conflicting with each other using are_overlapping
-    :param index: index of Lesson for which we are checking possible conflicts
-    :param lesson_list: lessons list
+    Sweep over intervals sorted by start and yield every pair that is overlapping.
+    Only intervals which did not end before the current one started are kept active,
+    so the cost is O(n log n + k) for n intervals and k yielded pairs
+    :param intervals: tuples (start, end, item) sharing the same resource
+    :return: pairs (item1, item2), item1 started not later than item2
+    """
+    active: List[Tuple[Any, int, Any, Any]] = []
+    ordered = sorted(enumerate(intervals), key=lambda x: (x[1][0], x[0]))
+    for order, (start, end, item) in ordered:
+        while active and active[0][0] < start:
+            heapq.heappop(active)
+        for active_end, _order, active_start, active_item in active:
+            if intervals_overlap(active_start, active_end, start, end):
+                yield active_item, item
+        heapq.heappush(active, (end, order, start, item))
+
+
+def resource_conflicts(lessons: Iterable[Lesson]) -> Iterator[Tuple[str, Lesson, Lesson, int]]:
+    """
+    Buckets lessons sharing the same professor, room or group
+    and yields overlapping lessons of every bucket found by overlapping_pairs
+    :param lessons: lessons to check against each other
+    :return: tuples (conflict type, Lesson1, Lesson2, object id), lessons in no particular order
+    """
+    buckets: Dict[Tuple[str, int], List[Tuple[Any, Any, Lesson]]] = defaultdict(list)
+    for lesson in lessons:
+        interval = (lesson.start_time, lesson.end_time, lesson)
+        for c_type, field in CONFLICT_RESOURCES:
+            buckets[(c_type, getattr(lesson, field))].append(interval)
+    for (c_type, object_id), intervals in buckets.items():
+        for lesson, lesson_2 in overlapping_pairs(intervals):
+            yield c_type, lesson, lesson_2, object_id
+
+
+def find_conflicts(lessons: Iterable[Lesson]) -> List[Tuple[str, Lesson, Lesson, int]]:
+    """
+    This function buckets lessons sharing the same professor, room and group
+    And then finds overlapping lessons in every bucket using overlapping_pairs
+    :param lessons: lessons to check against each other
     :return: List of tuples holding information about conflict.
              Tuple[str, Lesson1, Lesson2, int]
              str helps to differentiate which conflict it is
-             Lesson1 and Lesson2 are Lesson that are currently in conflict
+             Lesson1 and Lesson2 are Lesson that are currently in conflict,
+             Lesson1 has lower id
              int is Model object id responsible for conflict (Professor, Room, Group)
     """
     conflicts: List[Tuple[str, Lesson, Lesson, int]] = []
-    lesson = lesson_list[index]
-    for ind in range(index + 1, len(lesson_list)):
-        lesson_2 = lesson_list[ind]
-        if are_overlapping(lesson, lesson_2):
-            if lesson_2.professor == lesson.professor:
-                new_conflict = ("PROFESSOR", lesson, lesson_2, lesson.professor.id)
-                conflicts.append(new_conflict)
-            if lesson_2.room == lesson.room:
-                new_conflict = ('ROOM', lesson, lesson_2, lesson.room.id)
-                conflicts.append(new_conflict)
-            if lesson_2.group == lesson.group:
-                new_conflict = ("GROUP", lesson, lesson_2, lesson.group.id)
-                conflicts.append(new_conflict)
+    for c_type, lesson, lesson_2, object_id in resource_conflicts(lessons):
+        if lesson.id > lesson_2.id:
+            lesson, lesson_2 = lesson_2, lesson
+        conflicts.append((c_type, lesson, lesson_2, object_id))
     return conflicts
 
 
-def db_conflicts():
+def save_conflicts(conflicts: Iterable[Tuple[str, int, int, int]]):
     """
-    This function finds conflicts for every lesson in database by using check_lesson
+    This function adds conflicts to database in batches of CONFLICTS_BATCH_SIZE
+    It should be called inside a transaction, so that a failed batch leaves nothing behind
+    :param conflicts: tuples holding conflict type, ids of both lessons and object id
+    :return: nothing
+    """
+    batch_size = getattr(settings, 'CONFLICTS_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    Conflict.objects.bulk_create((Conflict(conflict_type=c_type,
+                                           first_lesson_id=f_lesson_id,
+                                           second_lesson_id=s_lesson_id,
+                                           object_id=o_id)
+                                  for c_type, f_lesson_id, s_lesson_id, o_id in conflicts),
+                                 batch_size=batch_size)
+
+
+def conflicts_ids(conflicts: Iterable[Tuple[str, Lesson, Lesson, int]]) \
+        -> Iterator[Tuple[str, int, int, int]]:
+    """Replaces lessons with their ids in tuples returned by find_conflicts"""
+    for c_type, f_lesson, s_lesson, o_id in conflicts:
+        yield c_type, f_lesson.id, s_lesson.id, o_id
+
+
+def epoch_seconds(values: Tuple[datetime.datetime, ...]) -> np.ndarray:
+    """Converts naive datetimes into int64 array of seconds since EPOCH"""
+    return np.fromiter(((value - EPOCH).total_seconds() for value in values),
+                       dtype=np.float64, count=len(values)).astype(np.int64)
+
+
+def overlapping_pairs_array(starts: np.ndarray, ends: np.ndarray, resources: np.ndarray) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized overlapping_pairs for many resources at once
+    Intervals are sorted by resource and start, so every interval is followed
+    by the ones which may overlap it, their range is found with searchsorted
+    :param starts: int64 array of interval starts
+    :param ends: int64 array of interval ends
+    :param resources: int64 array of resources of intervals
+    :return: arrays of positions of first and second interval of every overlapping pair
+    """
+    if not starts.size:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    ranks = np.unique(resources, return_inverse=True)[1]
+    base = min(starts.min(), ends.min())
+    span = max(starts.max(), ends.max()) - base + 1
+    order = np.lexsort((starts, ranks))
+    keys = ranks[order] * span + (starts[order] - base)
+    # first position with other resource or starting after interval ended
+    upper = np.searchsorted(keys, ranks[order] * span + (ends[order] - base), side='right')
+    positions = np.arange(order.size)
+    counts = np.maximum(upper - positions - 1, 0)
+    first = np.repeat(positions, counts)
+    # pairs of every interval with the ones following it within its range
+    second = first + 1 + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    first, second = order[first], order[second]
+    start1, end1, start2, end2 = starts[first], ends[first], starts[second], ends[second]
+    overlapping = ((start1 < end2) & (start2 < end1)) \
+        | ((start1 <= start2) & (end2 <= end1)) | ((start2 <= start1) & (end1 <= end2))
+    return first[overlapping], second[overlapping]
+
+
+def find_conflicts_array(lessons: Iterable[Tuple[int, Any, Any, int, int, int]]) \
+        -> List[Tuple[str, int, int, int]]:
+    """
+    Columnar counterpart of find_conflicts using overlapping_pairs_array
+    :param lessons: tuples (id, start_time, end_time, professor_id, room_id, group_id)
+    :return: tuples holding conflict type, ids of both lessons (lower first) and object id
+    """
+    columns = list(zip(*lessons))
+    if not columns:
+        return []
+    ids = np.array(columns[0], dtype=np.int64)
+    starts = epoch_seconds(columns[1])
+    ends = epoch_seconds(columns[2])
+    conflicts: List[Tuple[str, int, int, int]] = []
+    for (c_type, _field), column in zip(CONFLICT_RESOURCES, columns[3:]):
+        resources = np.array(column, dtype=np.int64)
+        first, second = overlapping_pairs_array(starts, ends, resources)
+        first_ids = np.minimum(ids[first], ids[second])
+        second_ids = np.maximum(ids[first], ids[second])
+        conflicts.extend(zip([c_type] * first.size, first_ids.tolist(), second_ids.tolist(),
+                             resources[first].tolist()))
+    return conflicts
+
+
+def bucket_conflicts(buckets: List[Tuple[str, int, List[Tuple[int, int, int]]]]) \
+        -> List[Tuple[str, int, int, int]]:
+    """
+    Finds conflicts in lessons already bucketed by resource, run by workers of parallel engine
+    :param buckets: tuples (conflict type, object id, intervals (start, end, lesson id))
+    :return: tuples holding conflict type, ids of both lessons (lower first) and object id
+    """
+    conflicts: List[Tuple[str, int, int, int]] = []
+    for c_type, object_id, intervals in buckets:
+        for lesson_id, lesson_2_id in overlapping_pairs(intervals):
+            conflicts.append((c_type, min(lesson_id, lesson_2_id),
+                              max(lesson_id, lesson_2_id), object_id))
+    return conflicts
+
+
+def process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Pool of worker processes able to import modules of the app
+    django.setup is run by workers when processes are spawned, not forked;
+    initializer needs Python 3.7, on older versions workers are forked
+    and inherit the configured app registry
+    """
+    if sys.version_info >= (3, 7):
+        return ProcessPoolExecutor(max_workers=workers, initializer=django.setup)
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def find_conflicts_parallel(lessons: Iterable[Tuple[int, Any, Any, int, int, int]],
+                            workers: int) -> List[Tuple[str, int, int, int]]:
+    """
+    Buckets lessons by professor, room and group and finds conflicts of
+    partitions of buckets in a pool of processes using bucket_conflicts
+    Buckets are spread so that partitions hold about the same number of lessons
+    :param lessons: tuples (id, start_time, end_time, professor_id, room_id, group_id)
+    :param workers: number of processes
+    :return: tuples holding conflict type, ids of both lessons (lower first) and object id
+    """
+    buckets: Dict[Tuple[str, int], List[Tuple[int, int, int]]] = defaultdict(list)
+    for lesson_id, start_time, end_time, *resources in lessons:
+        interval = (int((start_time - EPOCH).total_seconds()),
+                    int((end_time - EPOCH).total_seconds()), lesson_id)
+        for (c_type, _field), object_id in zip(CONFLICT_RESOURCES, resources):
+            buckets[(c_type, object_id)].append(interval)
+    partitions: List[List[Tuple[str, int, List[Tuple[int, int, int]]]]] = \
+        [[] for _ in range(max(workers, 1) * PARTITIONS_PER_WORKER)]
+    sizes = [0] * len(partitions)
+    for (c_type, object_id), intervals in sorted(buckets.items(), key=lambda x: -len(x[1])):
+        smallest = sizes.index(min(sizes))
+        partitions[smallest].append((c_type, object_id, intervals))
+        sizes[smallest] += len(intervals)
+    with process_pool(max(workers, 1)) as executor:
+        results = executor.map(bucket_conflicts, [part for part in partitions if part])
+        return sorted({conflict for result in results for conflict in result})
+
+
+def sql_conflicts_query() -> str:
+    """
+    Builds INSERT ... SELECT query finding conflicts with a self-join of lessons table
+    Every lesson is joined only with lessons starting during it, which lets database
+    use (resource, start_time) index. Lessons sharing a resource conflict when they overlap
+    in time, or when one contains the other, which covers lessons with zero duration
+    like intervals_overlap does
+    :return: query taking conflict type as parameter for every resource
+    """
+    quote = connection.ops.quote_name
+    lesson_table = quote(Lesson._meta.db_table)
+    start, end = quote('start_time'), quote('end_time')
+    selects = []
+    for _c_type, field in CONFLICT_RESOURCES:
+        column = quote(field)
+        selects.append(
+            "SELECT %s, CASE WHEN a.id < b.id THEN a.id ELSE b.id END, "
+            "CASE WHEN a.id < b.id THEN b.id ELSE a.id END, a.{column} "
+            "FROM {table} a JOIN {table} b ON a.{column} = b.{column} "
+            "AND b.{start} >= a.{start} AND b.{start} <= a.{end} "
+            "AND (b.{start} > a.{start} OR a.id < b.id) "
+            "AND ((a.{start} < b.{end} AND b.{start} < a.{end}) "
+            "OR (a.{start} <= b.{start} AND b.{end} <= a.{end}) "
+            "OR (b.{start} <= a.{start} AND a.{end} <= b.{end}))"
+            .format(column=column, table=lesson_table, start=start, end=end))
+    return "INSERT INTO {table} ({columns}) {selects}".format(
+        table=quote(Conflict._meta.db_table),
+        columns=", ".join(quote(column) for column in ('conflict_type', 'first_lesson_id',
+                                                       'second_lesson_id', 'object_id')),
+        selects=" UNION ALL ".join(selects))
+
+
+def sql_db_conflicts(_progress: Callable[[int], None]):
+    """
+    This function finds conflicts for every lesson in database with a single query,
+    lessons are never loaded into memory
+    :param _progress: not called, there is no point between start and end of the query
     :return: nothing
             Adds conflicts to database
     """
-    Conflict.objects.all().delete()
-    lessons = Lesson.objects.all()
-    lessons_list = list(lessons)
-    for index in range(len(lessons_list)):
-        lesson_conflicts = check_lesson(index, lessons_list)
-        for conflict in lesson_conflicts:
-            c_type, f_lesson, s_lesson, o_id = conflict
-            new_conflict = Conflict(conflict_type=c_type,
-                                    first_lesson=f_lesson,
-                                    second_lesson=s_lesson,
-                                    object_id=o_id)
-            new_conflict.save()
+    with transaction.atomic():
+        Conflict.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute(sql_conflicts_query(),
+                           [c_type for c_type, _field in CONFLICT_RESOURCES])
+
+
+def replace_conflicts(conflicts: List[Tuple[str, int, int, int]],
+                      progress: Callable[[int], None]):
+    """
+    Replaces all conflicts in database in one transaction,
+    so readers never see a partial table
+    :param conflicts: tuples holding conflict type, ids of both lessons and object id
+    :param progress: called with percent of work done once conflicts are found
+    :return: nothing
+    """
+    progress(50)
+    with transaction.atomic():
+        Conflict.objects.all().delete()
+        save_conflicts(conflicts)
+
+
+def python_db_conflicts(progress: Callable[[int], None]):
+    """
+    This function finds conflicts for every lesson in database by using find_conflicts
+    :param progress: called with percent of work done
+    :return: nothing
+            Adds conflicts to database
+    """
+    replace_conflicts(list(conflicts_ids(find_conflicts(Lesson.objects.all()))), progress)
+
+
+def numpy_db_conflicts(progress: Callable[[int], None]):
+    """
+    This function finds conflicts for every lesson in database by using find_conflicts_array
+    Only columns of lessons are read, no Lesson objects are created
+    :param progress: called with percent of work done
+    :return: nothing
+            Adds conflicts to database
+    """
+    lessons = Lesson.objects.values_list(
+        'id', 'start_time', 'end_time', *(field for _c_type, field in CONFLICT_RESOURCES))
+    replace_conflicts(find_conflicts_array(lessons), progress)
+
+
+def parallel_db_conflicts(progress: Callable[[int], None]):
+    """
+    This function finds conflicts for every lesson in database by using
+    find_conflicts_parallel with CONFLICTS_WORKERS processes
+    :param progress: called with percent of work done
+    :return: nothing
+            Adds conflicts to database
+    """
+    workers = getattr(settings, 'CONFLICTS_WORKERS', None) or os.cpu_count() or 1
+    lessons = Lesson.objects.values_list(
+        'id', 'start_time', 'end_time', *(field for _c_type, field in CONFLICT_RESOURCES))
+    replace_conflicts(find_conflicts_parallel(lessons, workers), progress)
+
+
+CONFLICTS_ENGINES = {
+    'python': python_db_conflicts,
+    'sql': sql_db_conflicts,
+    'numpy': numpy_db_conflicts,
+    'parallel': parallel_db_conflicts,
+}
+
+
+def db_conflicts(progress: Optional[Callable[[int], None]] = None):
+    """
+    This function finds conflicts for every lesson in database
+    with engine chosen by CONFLICTS_ENGINE setting
+    :param progress: called with percent of work done, when given
+    :return: nothing
+            Adds conflicts to database
+    """
+    engine = CONFLICTS_ENGINES[getattr(settings, 'CONFLICTS_ENGINE', DEFAULT_ENGINE)]
+    engine(progress or (lambda _percent: None))
+
+
+def bump_schedule_version(conflicts_updated: bool) -> ScheduleState:
+    """
+    Marks schedule as changed, should be called inside a transaction
+    :param conflicts_updated: if conflicts were already updated for this change
+    :return: state of schedule after change
+    """
+    state = ScheduleState.load(for_update=True)
+    conflicts_current = state.conflicts_version == state.version \
+        and state.conflicts_status == ScheduleState.IDLE
+    state.version += 1
+    state.changed = timezone.now()
+    if conflicts_updated and conflicts_current:
+        state.conflicts_version = state.version
+    state.save()
+    return state
+
+
+def neighbours(lessons: List[Lesson], exclude_ids: Iterable[int]):
+    """
+    Lessons from database which could be in conflict with given lessons
+    :param lessons: lessons which are checked
+    :param exclude_ids: ids of lessons left out, as their database state is outdated
+    :return: QuerySet of lessons overlapping any of given lessons
+             and sharing a professor, room or group with it, found in the interval index,
+             or of lessons from their time window when the index is stale
+    """
+    index = get_index()
+    if index is None:
+        return Lesson.objects \
+            .filter(Q(professor_id__in={lesson.professor_id for lesson in lessons}) |
+                    Q(room_id__in={lesson.room_id for lesson in lessons}) |
+                    Q(group_id__in={lesson.group_id for lesson in lessons}),
+                    start_time__lte=max(lesson.end_time for lesson in lessons),
+                    end_time__gte=min(lesson.start_time for lesson in lessons)) \
+            .exclude(id__in=exclude_ids)
+    lesson_ids = {lesson_id for lesson in lessons for _c_type, field in CONFLICT_RESOURCES
+                  for lesson_id in index.lookup(field, getattr(lesson, field),
+                                                lesson.start_time, lesson.end_time)}
+    return Lesson.objects.filter(id__in=lesson_ids - set(exclude_ids))
+
+
+def update_conflicts_for(lesson_ids: Iterable[int]):
+    """
+    This function refreshes conflicts of changed lessons only
+    Conflicts touching these lessons are dropped and found again by checking them
+    against lessons from the same time window sharing a professor, room or group
+    :param lesson_ids: ids of created, edited or removed lessons
+    :return: nothing
+            Adds conflicts to database
+    """
+    lesson_ids = {int(lesson_id) for lesson_id in lesson_ids}
+    if not lesson_ids:
+        return
+    lessons_changed(lesson_ids)
+    changed = list(Lesson.objects.filter(id__in=lesson_ids))
+    conflicts: List[Tuple[str, Lesson, Lesson, int]] = []
+    if changed:
+        conflicts = [conflict for conflict
+                     in find_conflicts(changed + list(neighbours(changed, lesson_ids)))
+                     if conflict[1].id in lesson_ids or conflict[2].id in lesson_ids]
+    with transaction.atomic():
+        Conflict.objects.filter(Q(first_lesson_id__in=lesson_ids) |
+                                Q(second_lesson_id__in=lesson_ids)).delete()
+        save_conflicts(conflicts_ids(conflicts))
+        bump_schedule_version(conflicts_updated=True)
+
+
+def forecast_conflicts(proposed: List[Lesson]) -> List[Tuple[str, Lesson, Lesson, int]]:
+    """
+    Finds conflicts the proposed lessons would be in, without writing anything
+    Proposed lessons are usually unsaved; ones having id replace their database version.
+    Resources which don't exist yet (id None) can't be in conflict
+    :param proposed: lessons as they would be after create or edit
+    :return: tuples (conflict type, proposed Lesson, other Lesson, object id),
+             other Lesson is from database or is another proposed lesson
+    """
+    if not proposed:
+        return []
+    others = neighbours(proposed, [lesson.id for lesson in proposed if lesson.id is not None]) \
+        .select_related('professor', 'room', 'group')
+    return proposed_conflicts(proposed, others)
+
+
+def forecast_range_conflicts(proposed: List[Lesson]) -> List[Tuple[str, Lesson, Lesson, int]]:
+    """
+    forecast_conflicts for many new lessons, like a whole imported file
+    Lessons from database are read with one query over the time range of proposed lessons
+    instead of looking up neighbours of every lesson.
+    Resources which don't exist yet may have negative placeholder ids,
+    then they are in conflict only with other proposed lessons
+    :param proposed: unsaved lessons
+    :return: tuples (conflict type, proposed Lesson, other Lesson, object id),
+             other Lesson is from database or is another proposed lesson
+    """
+    if not proposed:
+        return []
+    others = Lesson.objects \
+        .filter(start_time__lt=max(lesson.end_time for lesson in proposed),
+                end_time__gt=min(lesson.start_time for lesson in proposed)) \
+        .only('name', 'start_time', 'end_time', 'professor_id', 'room_id', 'group_id')
+    return proposed_conflicts(proposed, others)
+
+
+def proposed_conflicts(proposed: List[Lesson], others: Iterable[Lesson]) \
+        -> List[Tuple[str, Lesson, Lesson, int]]:
+    """
+    Conflicts of proposed lessons with each other and with candidate lessons from database,
+    conflicts between two candidates and ones of resources without id are left out
+    :param proposed: lessons as they would be after create, edit or import
+    :param others: lessons from database which may be in conflict with proposed ones
+    :return: tuples (conflict type, proposed Lesson, other Lesson, object id)
+    """
+    proposed_objects = {id(lesson) for lesson in proposed}
+    conflicts = []
+    for c_type, lesson, lesson_2, object_id in resource_conflicts(proposed + list(others)):
+        if object_id is None:
+            continue
+        if id(lesson) not in proposed_objects:
+            lesson, lesson_2 = lesson_2, lesson
+        if id(lesson) in proposed_objects:
+            conflicts.append((c_type, lesson, lesson_2, object_id))
+    return conflicts
+
+
+def conflict_key(conflict: Conflict) -> Tuple[str, int, int, int]:
+    """
+    Canonical key of conflict which does not depend on order of its lessons
+    Built from ids only, so related lessons are never loaded
+    :param conflict: Conflict object
+    :return: Tuple[str, int, int, int] conflict type, object id, lower and higher lesson id
+    """
+    lesson_ids = (conflict.first_lesson_id, conflict.second_lesson_id)
+    return conflict.conflict_type, conflict.object_id, min(lesson_ids), max(lesson_ids)
 
 
 def conflicts_diff(past_conflicts: List[Conflict], current_conflicts: List[Conflict]) \
@@ -75,16 +501,12 @@ def conflicts_diff(past_conflicts: List[Conflict], current_conflicts: List[Confl
     """
     :param past_conflicts: list of conflicts before change
     :param current_conflicts: list of conflicts after change
-    :return:
-    """
-    removed_conflicts: List[Conflict] = []
-    current_conflicts_copy = copy.deepcopy(current_conflicts)
-    for conflict in past_conflicts:
-        perfect_match = False
-        for conflict2 in current_conflicts:
-            if conflict.__eq__(conflict2):
-                perfect_match = True
-                current_conflicts_copy.remove(conflict2)
-        if not perfect_match:
-            removed_conflicts.append(conflict)
-    return current_conflicts_copy, removed_conflicts
+    :return: new conflicts and removed conflicts, compared by conflict_key
+    """
+    past_keys = {conflict_key(conflict) for conflict in past_conflicts}
+    current_keys = {conflict_key(conflict) for conflict in current_conflicts}
+    new_conflicts = [conflict for conflict in current_conflicts
+                     if conflict_key(conflict) not in past_keys]
+    removed_conflicts = [conflict for conflict in past_conflicts
+                         if conflict_key(conflict) not in current_keys]
+    return new_conflicts, removed_conflicts
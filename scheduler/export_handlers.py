@@ -1,16 +1,46 @@
 """Data export functions"""
+import csv
 from tempfile import NamedTemporaryFile
+from typing import Iterator
 
 import pandas as pd
+from django.conf import settings
 
-from scheduler.models import Lesson, Group, Room
+from scheduler.models import Lesson
 
+# lessons fetched from database at once by csv export, unless EXPORT_CHUNK_SIZE is set
+DEFAULT_CHUNK_SIZE = 2000
 
-def export_to_csv(start_time, end_time):
-    data_frame = get_lessons(start_time, end_time, True)
-    temp_file = NamedTemporaryFile(suffix='.csv', delete=False)
-    data_frame.to_csv(temp_file.name, index=False)
-    return temp_file
+COLUMNS = ['Date', 'Start time', 'End time', 'Lesson', 'Professor', 'Group', 'Room']
+
+# values of exported lesson, read by lessons_between
+FIELDS = ['start_time', 'end_time', 'name', 'professor__name', 'professor__surname',
+          'group__name', 'room__number']
+
+
+class Echo:  # pylint: disable=too-few-public-methods
+    """File-like object handing back what is written, lets csv.writer produce lines"""
+
+    @staticmethod
+    def write(value: str) -> str:
+        """Returns the written line instead of storing it"""
+        return value
+
+
+def export_to_csv(start_time, end_time) -> Iterator[str]:
+    """
+    Lines of csv file with lessons in given time period, meant for StreamingHttpResponse
+    Lessons are read in chunks of EXPORT_CHUNK_SIZE, with server-side cursor where database
+    supports it, so memory use does not grow with the number of lessons
+    """
+    writer = csv.writer(Echo(), lineterminator='\n')
+    yield writer.writerow(COLUMNS)
+    lessons = lessons_between(start_time, end_time) \
+        .iterator(chunk_size=getattr(settings, 'EXPORT_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+    for start, end, name, professor_name, professor_surname, group, room in lessons:
+        yield writer.writerow((start.strftime("%d-%m-%y"), start.strftime("%H:%M"),
+                               end.strftime("%H:%M"), name,
+                               professor_name + " " + professor_surname, group, room))
 
 
 def export_to_excel(start_time, end_time):
@@ -21,17 +51,27 @@ def export_to_excel(start_time, end_time):
 
 
 def get_lessons(start_time, end_time, iscsv):
-    """returns list of lessons in given time period"""
-    lessons_query = Lesson.objects.filter(start_time__range=[start_time, end_time],
-                                          end_time__range=[start_time, end_time])
-    lessons = [(q.start_time.strftime("%d-%m-%y" if iscsv else "%Y-%m-%d"),
-                q.start_time.strftime("%H:%M" if iscsv else "%H:%M:%S"),
-                q.end_time.strftime("%H:%M" if iscsv else "%H:%M:%S"),
-                q.name,
-                (q.professor.name + " " + q.professor.surname),
-                Group.objects.filter(id=q.group_id)[:1].get().name,
-                Room.objects.filter(id=q.room_id)[:1].get().number,)
-               for q in lessons_query]
-    return pd.DataFrame(lessons,
-                        columns=['Date', 'Start time', 'End time', 'Lesson', 'Professor', 'Group',
-                                 'Room'])
+    """
+    Returns DataFrame of lessons in given time period, read with a single query
+    and formatted by whole columns
+    """
+    lessons = pd.DataFrame.from_records(list(lessons_between(start_time, end_time)),
+                                        columns=FIELDS)
+    date_format, time_format = ("%d-%m-%y", "%H:%M") if iscsv else ("%Y-%m-%d", "%H:%M:%S")
+    starts = pd.to_datetime(lessons['start_time'])
+    ends = pd.to_datetime(lessons['end_time'])
+    return pd.DataFrame({'Date': starts.dt.strftime(date_format),
+                         'Start time': starts.dt.strftime(time_format),
+                         'End time': ends.dt.strftime(time_format),
+                         'Lesson': lessons['name'],
+                         'Professor': lessons['professor__name'] + " "
+                                      + lessons['professor__surname'],
+                         'Group': lessons['group__name'],
+                         'Room': lessons['room__number']}, columns=COLUMNS)
+
+
+def lessons_between(start_time, end_time):
+    """Lessons in given time period as tuples of FIELDS, joined with professor, group and room"""
+    return Lesson.objects \
+        .filter(start_time__range=[start_time, end_time], end_time__range=[start_time, end_time]) \
+        .values_list(*FIELDS)
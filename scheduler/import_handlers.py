@@ -1,11 +1,57 @@
 """Data import functions"""
 import datetime as dt
-from typing import List, Tuple
+import io
+import os
+from bisect import bisect_right
+from collections import defaultdict
+import hashlib
+from itertools import islice
+from zipfile import BadZipFile, ZipFile
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
+import numpy as np
 from numpy import nan
+import openpyxl
+from openpyxl.utils.exceptions import InvalidFileException
 import pandas as pd
+from django.conf import settings
+from django.db import transaction
 
-from scheduler.model_util import get_professor, get_room, get_group
-from scheduler.models import Lesson, Student
+from scheduler.interval_index import lessons_changed
+from scheduler.conflicts_checker import forecast_range_conflicts, process_pool
+from scheduler.model_util import get_professors, get_rooms, get_groups, find_professors, \
+    find_rooms, find_groups
+from scheduler.models import Lesson, Student, ImportedFile, ScheduleState
+
+# lessons inserted with a single query, unless IMPORT_BATCH_SIZE is set
+DEFAULT_BATCH_SIZE = 1000
+
+# rows of file read and committed at once by import jobs,
+# unless IMPORT_CHUNK_SIZE is set
+DEFAULT_CHUNK_SIZE = 10000
+
+# files of batch upload, also when they are inside zip archive
+BATCH_EXTENSIONS = ('.csv', '.xlsx')
+
+# parsed row: index, name, (professor name, surname), group, room, start, end
+LessonRecord = Tuple[int, str, Tuple[str, str], str, str, dt.datetime, dt.datetime]
+
+# conflict forecast by dry run: conflict type, row index, index of other row or Lesson
+ImportConflict = Tuple[str, int, Union[int, Lesson]]
+
+# result of file imported by import_batch: file name, number of rows, lessons added,
+# indexes of incorrect and duplicate rows, exception which stopped import of the file or None
+BatchResult = Tuple[str, int, int, List[int], List[int], Optional[Exception]]
+
+# parsed student: row index, index number, (name, surname), group
+StudentRecord = Tuple[int, int, Tuple[str, str], str]
+
+# index number of student has six digits, written as text or number like 123456.0
+INDEX_PATTERN = r'^\s*(\d{6})(?:\.0*)?\s*$'
+FIRST_INDEX = 100000
+
+# csv date DD-MM-YY or YYYY-MM-DD and time HH:MM(:SS), seconds are ignored
+DATE_PATTERN = r'^(\d+)-\s*(\d+)\s*-\s*(\d+)\s*$'
+TIME_PATTERN = r'^\s*(\d+)\s*:\s*(\d+)\s*(?::|$)'
 
 
 class ImportSizeException(Exception):
@@ -16,93 +62,271 @@ class ImportExtensionException(Exception):
     pass
 
 
-def parse_data(data: pd.DataFrame, ext: str) -> Tuple[int, List[int], List[int]]:
+class ImportCorruptedException(Exception):
+    pass
+
+
+def parse_data(data: pd.DataFrame, ext: str, dry_run: bool = False) \
+        -> Tuple[int, List[int], List[int]]:
     """
     Parse basic info, process extension and pass to designated function
     :param data: DataFrame with lessons
         Accepted format: date | start_time | end_time | Subject | Professor | Group | Room
     :param ext: File extension: .csv or .xlsx
+    :param dry_run: only validate the file and find duplicates, nothing is written
     :return: number of lessons added
     """
     if len(data.columns) == 7:
         if ext == '.csv':
-            return import_csv(data)
+            return import_csv(data, dry_run)
         if ext == '.xlsx':
-            return import_excel(data)
+            return import_excel(data, dry_run)
         raise ImportExtensionException
     raise ImportSizeException
 
 
-def import_csv(data: pd.DataFrame) -> Tuple[int, List[int], List[int]]:
+def parse_records(data: pd.DataFrame, ext: str) -> Tuple[List[LessonRecord], List[int]]:
+    """
+    :param data: DataFrame with lessons
+    :param ext: File extension: .csv or .xlsx
+    :return: parsed correct rows and indexes of incorrect rows
+    """
+    if len(data.columns) != 7:
+        raise ImportSizeException
+    if ext == '.csv':
+        return parse_csv(data)
+    if ext == '.xlsx':
+        return parse_excel(data)
+    raise ImportExtensionException
+
+
+def import_csv(data: pd.DataFrame, dry_run: bool = False) -> Tuple[int, List[int], List[int]]:
     """
     Parse csv data from DataFrame and add to database
     :param data: consists of simple types (str or int)
         Date: DD-MM-YY or YYYY-MM-DD  Time: HH:MM(:SS)
+    :param dry_run: nothing is written, lessons which would be added are counted
     :return: number of lessons added
     """
-    added_columns = 0
-    incorrect = []
-    duplicate = []
-    for row in data.itertuples():
-        if row.count(nan) != 0 or not check_types_csv(row):
-            incorrect.append(row[0])
-            continue
-        try:
-            date = [val for val in row[1].split("-")]
-            start_t = [val for val in row[2].split(":")]
-            end_t = [val for val in row[3].split(":")]
-            professor_data = row[5].strip().split()
-            if len(date) == 3 and len(start_t) >= 2 and len(end_t) >= 2\
-                    and len(professor_data) == 2:
-                if len(date[0]) == 2:
-                    start_date = dt.datetime(int(date[2]) + 2000, int(date[1]), int(date[0]),
-                                             int(start_t[0]), int(start_t[1]))
-                    end_date = dt.datetime(int(date[2]) + 2000, int(date[1]), int(date[0]),
-                                           int(end_t[0]), int(end_t[1]))
-                elif len(date[0]) == 4:
-                    start_date = dt.datetime(int(date[0]), int(date[1]), int(date[2]),
-                                             int(start_t[0]), int(start_t[1]))
-                    end_date = dt.datetime(int(date[0]), int(date[1]), int(date[2]),
-                                           int(end_t[0]), int(end_t[1]))
-                else:
-                    incorrect.append(row[0])
-                    continue
-                if start_date > end_date:
-                    incorrect.append(row[0])
-                    continue
-                professor = get_professor(professor_data[0], professor_data[1])
-                room = get_room(str(row[7]))
-                group = get_group(str(row[6]))
-                _lesson, created = Lesson.objects.get_or_create(
-                    name=str(row[4]).strip(),
-                    professor=professor,
-                    room=room,
-                    group=group,
-                    start_time=start_date,
-                    end_time=end_date
-                )
-                if created:
-                    added_columns += 1
-                else:
-                    duplicate.append(row[0])
-            else:
-                incorrect.append(row[0])
-        except ValueError:
-            incorrect.append(row[0])
-            continue
-    return added_columns, incorrect, duplicate
+    records, incorrect = parse_csv(data)
+    added, duplicate = save_lessons(records, dry_run)
+    return added, incorrect, duplicate
+
+
+class Distinct:
+    """
+    Column split into its distinct values and codes of rows, schedules repeat the same dates,
+    times, professors and rooms in thousands of rows, so only distinct values are parsed
+    """
+
+    def __init__(self, column: pd.Series):
+        self.codes, uniques = pd.factorize(column)
+        self.values = pd.Series(uniques, dtype=object)
+
+    def missing(self) -> np.ndarray:
+        """True where value is NaN"""
+        return self.codes == -1
+
+    def map(self, function: Callable[[pd.Series], np.ndarray], missing) -> np.ndarray:
+        """
+        :param function: maps Series of distinct values to array of results
+        :param missing: result for NaN
+        :return: array of results for every row
+        """
+        # code of NaN is -1, so it takes the last, appended result
+        return np.append(function(self.values), [missing])[self.codes]
+
+
+def instances(values: pd.Series, types) -> np.ndarray:
+    """True where value is instance of types"""
+    return np.array([isinstance(value, types) for value in values], dtype=bool)
+
+
+def parse_dates(values: pd.Series) -> np.ndarray:
+    """
+    Date format is chosen for every value by length of its first part,
+    so DD-MM-YY and YYYY-MM-DD can be mixed in a file.
+    DD-MM-YYYY is incorrect, row by row import used to take it for year 4019 and so on
+    :param values: dates DD-MM-YY or YYYY-MM-DD
+    :return: datetime64 array, NaT where date is incorrect
+    """
+    date = values.astype(str).str.extract(DATE_PATTERN)
+    short_year = ((date[0].str.len() == 2) & (date[2].str.len() == 2)).values
+    long_year = (date[0].str.len() == 4).values
+    date = date.apply(pd.to_numeric).fillna(1)
+    days = pd.to_datetime(pd.DataFrame({'year': np.where(short_year, date[2] + 2000, date[0]),
+                                        'month': date[1],
+                                        'day': np.where(short_year, date[0], date[2])}),
+                          errors='coerce').values
+    days[~(short_year | long_year)] = np.datetime64('NaT')
+    return days
 
 
-def import_excel(data: pd.DataFrame) -> Tuple[int, List[int], List[int]]:
+def parse_minutes(values: pd.Series) -> np.ndarray:
+    """
+    :param values: times HH:MM(:SS)
+    :return: minutes since midnight, NaN where time is incorrect
+    """
+    time = values.astype(str).str.extract(TIME_PATTERN).apply(pd.to_numeric)
+    return (time[0] * 60 + time[1]).where((time[0] < 24) & (time[1] < 60)).values
+
+
+def split_names(values: pd.Series) -> np.ndarray:
+    """Tuples (name, surname), None where value is not two words"""
+    names = np.empty(len(values), dtype=object)
+    names[:] = [tuple(words) if len(words) == 2 else None
+                for words in values.astype(str).str.split()]
+    return names
+
+
+def add_minutes(days: np.ndarray, minutes: np.ndarray) -> List[dt.datetime]:
+    """Adds minutes to datetime64 days and converts them into datetime objects"""
+    return (days + minutes.astype(np.int64).astype('timedelta64[m]')) \
+        .astype('datetime64[us]').tolist()
+
+
+def parse_csv(data: pd.DataFrame) -> Tuple[List[LessonRecord], List[int]]:
+    """
+    Parses whole columns of csv data at once, every distinct value only once
+    :param data: DataFrame with lessons from csv file
+    :return: parsed correct rows and indexes of incorrect rows
+    """
+    columns = [Distinct(data.iloc[:, position]) for position in range(7)]
+    valid = np.ones(len(data), dtype=bool)
+    for column in columns:
+        valid &= ~column.missing()
+    for column in columns[:5]:
+        valid &= column.map(lambda values: instances(values, str), False)
+    valid &= columns[6].map(lambda values: instances(values, (str, int, float)), False)
+
+    days = columns[0].map(parse_dates, np.datetime64('NaT'))
+    start = columns[1].map(parse_minutes, nan)
+    end = columns[2].map(parse_minutes, nan)
+    valid &= ~np.isnat(days) & (start <= end)
+
+    professor = columns[4].map(split_names, None)
+    valid &= pd.notna(professor)
+
+    days = days[valid]
+    records = list(zip(data.index[valid].tolist(),
+                       columns[3].map(lambda values: values.astype(str).str.strip().values,
+                                      None)[valid].tolist(),
+                       professor[valid].tolist(),
+                       columns[5].map(lambda values: values.astype(str).values,
+                                      None)[valid].tolist(),
+                       columns[6].map(lambda values: values.astype(str).values,
+                                      None)[valid].tolist(),
+                       add_minutes(days, start[valid]),
+                       add_minutes(days, end[valid])))
+    return records, data.index[~valid].tolist()
+
+
+def read_upload(file, ext: str) -> pd.DataFrame:
+    """
+    Reads uploaded file where Django keeps it, without saving a copy first
+    Uploads bigger than FILE_UPLOAD_MAX_MEMORY_SIZE are in a temporary file,
+    csv is memory mapped from it, smaller ones are read from memory
+    :param file: uploaded file
+    :param ext: File extension: .csv or .xlsx
+    """
+    if hasattr(file, 'temporary_file_path'):
+        source = file.temporary_file_path()
+    else:
+        source = file
+        source.seek(0)
+    if ext == '.csv':
+        return pd.read_csv(source, memory_map=isinstance(source, str))
+    if ext == '.xlsx':
+        chunks = list(read_xlsx_chunks(source, getattr(settings, 'IMPORT_CHUNK_SIZE',
+                                                       DEFAULT_CHUNK_SIZE)))
+        return pd.concat(chunks) if chunks else pd.DataFrame()
+    raise ImportExtensionException
+
+
+def excel_value(value):
+    """Cell value as read by pd.read_excel, NaN for empty cell and Timestamp for date"""
+    if value is None:
+        return nan
+    if isinstance(value, dt.datetime):
+        return pd.Timestamp(value)
+    return value
+
+
+def read_xlsx_chunks(file, chunk_size: int, start_row: int = 0) -> Iterator[pd.DataFrame]:
+    """
+    Streams rows of the first sheet of xlsx file with openpyxl in read-only mode,
+    so memory depends on size of chunk, not of workbook
+    The first row holds names of columns, rows are cut to its width, empty rows are skipped
+    :param file: path or file object of xlsx file
+    :param chunk_size: number of rows in chunk
+    :param start_row: number of rows skipped, to resume import after the last committed chunk
+    :return: chunks indexed by row number like DataFrame read with pd.read_excel
+    """
+    try:
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    except (BadZipFile, InvalidFileException, KeyError) as error:
+        raise ImportCorruptedException from error
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        while header and header[-1] is None:
+            header.pop()
+        width = len(header)
+        rows = islice((row for row in rows if any(value is not None for value in row)),
+                      start_row, None)
+        first = start_row
+        for chunk in iter(lambda: list(islice(rows, chunk_size)), []):
+            yield pd.DataFrame([[excel_value(value) for value in row[:width]]
+                                + [nan] * (width - len(row)) for row in chunk],
+                               columns=header, index=range(first, first + len(chunk)),
+                               dtype=object).infer_objects()
+            first += len(chunk)
+    finally:
+        workbook.close()
+
+
+def read_chunks(file, ext: str, chunk_size: int, start_row: int = 0) -> Iterator[pd.DataFrame]:
+    """
+    Reads file in chunks of chunk_size rows, indexed by row number in the whole file
+    :param file: path or file object of csv or xlsx file
+    :param ext: File extension: .csv or .xlsx
+    :param chunk_size: number of rows in chunk
+    :param start_row: number of rows skipped, to resume import after the last committed chunk
+    """
+    if ext == '.csv':
+        # every column is read as text, so that types don't depend on values in the chunk;
+        # rows are skipped after parsing, as blank lines and quoted line breaks
+        # make lines of file differ from rows
+        for chunk in pd.read_csv(file, chunksize=chunk_size, dtype=str):
+            if len(chunk) and chunk.index[-1] >= start_row:
+                yield chunk[chunk.index >= start_row]
+    elif ext == '.xlsx':
+        yield from read_xlsx_chunks(file, chunk_size, start_row)
+    else:
+        raise ImportExtensionException
+
+
+def import_excel(data: pd.DataFrame, dry_run: bool = False) -> Tuple[int, List[int], List[int]]:
     """
     Parse excel data from DataFrame and add to database
     :param data: consists of complex types for date etc.
         Date: YYYY-MM-DD  Time: HH:MM(:SS)
+    :param dry_run: nothing is written, lessons which would be added are counted
     :return: number of lessons added
     """
-    added_columns = 0
+    records, incorrect = parse_excel(data)
+    added, duplicate = save_lessons(records, dry_run)
+    return added, incorrect, duplicate
+
+
+def parse_excel(data: pd.DataFrame) -> Tuple[List[LessonRecord], List[int]]:
+    """
+    Parses excel data row by row
+    :param data: DataFrame with lessons from xlsx file
+    :return: parsed correct rows and indexes of incorrect rows
+    """
+    records: List[LessonRecord] = []
     incorrect = []
-    duplicate = []
     for row in data.itertuples():
         if row.count(nan) != 0 or not check_types_excel(row):
             incorrect.append(row[0])
@@ -133,34 +357,276 @@ def import_excel(data: pd.DataFrame) -> Tuple[int, List[int], List[int]]:
             if start_date > end_date:
                 incorrect.append(row[0])
                 continue
-            professor = get_professor(professor_data[0], professor_data[1])
-            room = get_room(str(row[7]))
-            group = get_group(str(row[6]))
-            _lesson, created = Lesson.objects.get_or_create(
-                name=str(row[4]).strip(),
-                professor=professor,
-                room=room,
-                group=group,
-                start_time=start_date,
-                end_time=end_date
-            )
-            if created:
-                added_columns += 1
-            else:
-                duplicate.append(row[0])
+            records.append((row[0], str(row[4]).strip(), tuple(professor_data),
+                            str(row[6]), str(row[7]), start_date, end_date))
         else:
             incorrect.append(row[0])
-    return added_columns, incorrect, duplicate
+    return records, incorrect
 
 
-def check_types_csv(row: tuple) -> bool:
-    """Returns true if row from csv file has correct types"""
-    if not all((isinstance(x, str) for x in row[1:6])):
-        return False
-    if not isinstance(row[7], (str, int, float)):
-        # 3.27, 3.27a and 137 should all be supported
-        return False
-    return True
+def batch_files(files) -> List[Tuple[str, bytes]]:
+    """
+    Contents of files uploaded together, zip archives are replaced by schedule files inside
+    :param files: uploaded files
+    :return: pairs (file name, content)
+    """
+    contents = []
+    for file in files:
+        file.seek(0)
+        if os.path.splitext(file.name)[1].lower() != '.zip':
+            contents.append((file.name, file.read()))
+            continue
+        try:
+            with ZipFile(file) as archive:
+                contents.extend((info.filename, archive.read(info))
+                                for info in archive.infolist()
+                                if os.path.splitext(info.filename)[1].lower() in BATCH_EXTENSIONS
+                                and not info.filename.startswith('__MACOSX/'))
+        except BadZipFile as error:
+            raise ImportCorruptedException from error
+    return contents
+
+
+def parse_batch_file(file: Tuple[str, bytes]) \
+        -> Tuple[List[LessonRecord], List[int], int, Optional[Exception]]:
+    """
+    Parses one file of batch, run by workers of import_batch
+    :param file: pair (file name, content)
+    :return: parsed correct rows, indexes of incorrect rows, number of rows
+             and exception which stopped parsing of the file or None
+    """
+    name, content = file
+    ext = os.path.splitext(name)[1].lower()
+    try:
+        data = read_upload(io.BytesIO(content), ext)
+        records, incorrect = parse_records(data, ext)
+    except (ImportSizeException, ImportExtensionException, ImportCorruptedException,
+            UnicodeDecodeError) as error:
+        return [], [], 0, error
+    return records, incorrect, len(data), None
+
+
+def parse_batch(files: List[Tuple[str, bytes]]) \
+        -> List[Tuple[List[LessonRecord], List[int], int, Optional[Exception]]]:
+    """
+    Runs parse_batch_file for every file in a pool of IMPORT_WORKERS processes,
+    one file per worker, a single file is parsed in this process
+    """
+    workers = min(getattr(settings, 'IMPORT_WORKERS', None) or os.cpu_count() or 1, len(files))
+    if workers <= 1:
+        return [parse_batch_file(file) for file in files]
+    with process_pool(workers) as executor:
+        return list(executor.map(parse_batch_file, files))
+
+
+def import_batch(files: List[Tuple[str, bytes]], dry_run: bool = False) -> List[BatchResult]:
+    """
+    Imports several schedule files at once
+    Files are parsed and validated in parallel by parse_batch, then lessons of all files
+    are saved by store_lessons in a single transaction, so rows repeated in another file
+    are duplicates as well
+    :param files: pairs (file name, content) from batch_files
+    :param dry_run: nothing is written, lessons which would be added are counted
+    :return: for every file: name, number of rows, lessons added,
+             indexes of incorrect and duplicate rows and exception which stopped it or None
+    """
+    parsed = parse_batch(files)
+    # rows of all files are numbered one after another, starting at offset of the file
+    offsets = []
+    records: List[LessonRecord] = []
+    offset = 0
+    for file_records, _incorrect, rows, _error in parsed:
+        offsets.append(offset)
+        records.extend((record[0] + offset,) + record[1:] for record in file_records)
+        offset += rows
+    planned, duplicate = store_lessons(records, dry_run)
+    added = [0] * len(files)
+    duplicates: List[List[int]] = [[] for _ in files]
+    for index, _lesson in planned:
+        added[bisect_right(offsets, index) - 1] += 1
+    for index in duplicate:
+        file_number = bisect_right(offsets, index) - 1
+        duplicates[file_number].append(index - offsets[file_number])
+    return [(name, rows, file_added, incorrect, file_duplicate, error)
+            for (name, _content), (_records, incorrect, rows, error), file_added, file_duplicate
+            in zip(files, parsed, added, duplicates)]
+
+
+def file_digest(file) -> str:
+    """SHA-256 of uploaded file"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_digest(content: bytes) -> str:
+    """SHA-256 of file from batch upload, the same as file_digest of the file uploaded alone"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def imported_before(digest: str) -> Optional[ImportedFile]:
+    """Identical schedule file imported before, None if schedule was changed since"""
+    return ImportedFile.objects.filter(digest=digest,
+                                       schedule_version=ScheduleState.load().version).first()
+
+
+def remember_import(digest: str, name: str, rows: int, incorrect_count: int):
+    """Records imported schedule file with the current version of schedule"""
+    ImportedFile.objects.update_or_create(digest=digest, defaults={
+        'original_name': name, 'rows': rows, 'incorrect_count': incorrect_count,
+        'schedule_version': ScheduleState.load().version})
+
+
+def row_hash(record: LessonRecord) -> str:
+    """Hash of parsed row, the same for every upload of the same lesson"""
+    _index, name, (professor_name, professor_surname), group, room, start, end = record
+    row = "\x1f".join((name, professor_name, professor_surname, group, room,
+                       start.isoformat(), end.isoformat()))
+    return hashlib.blake2b(row.encode(), digest_size=16).hexdigest()
+
+
+def save_lessons(records: List[LessonRecord], dry_run: bool = False) -> Tuple[int, List[int]]:
+    """
+    Adds parsed lessons to database in a single transaction
+    Rows imported before are recognised by hash of the row stored in lessons,
+    so a changed upload costs about as much as its new rows.
+    For new rows professors, rooms and groups are resolved at once,
+    lessons already in database are found with one query over the time range of new rows
+    and the new ones are inserted with bulk_create in batches of IMPORT_BATCH_SIZE
+    :param records: parsed rows
+        (row index, name, (professor name, surname), group, room, start, end)
+    :param dry_run: nothing is written, lessons which would be added are counted
+    :return: number of lessons added and indexes of duplicate rows,
+             which are in database or earlier in the file
+    """
+    planned, duplicate = store_lessons(records, dry_run)
+    return len(planned), duplicate
+
+
+def store_lessons(records: List[LessonRecord], dry_run: bool = False) \
+        -> Tuple[List[Tuple[int, Lesson]], List[int]]:
+    """
+    save_lessons which tells the rows lessons were added from
+    :return: pairs (row index, added Lesson) and indexes of duplicate rows
+    """
+    if not records:
+        return [], []
+    with transaction.atomic():
+        planned, duplicate = plan_lessons(records, dry_run)
+        if not dry_run:
+            Lesson.objects.bulk_create([lesson for _index, lesson in planned],
+                                       batch_size=getattr(settings, 'IMPORT_BATCH_SIZE',
+                                                          DEFAULT_BATCH_SIZE))
+    if planned and not dry_run:
+        lessons_changed()
+    return planned, duplicate
+
+
+def plan_lessons(records: List[LessonRecord], dry_run: bool) \
+        -> Tuple[List[Tuple[int, Lesson]], List[int]]:
+    """
+    Finds rows which are not in database yet
+    :param records: parsed rows
+    :param dry_run: professors, rooms and groups missing in database are not created,
+                    they get negative ids instead
+    :return: pairs (row index, unsaved Lesson) and sorted indexes of duplicate rows
+    """
+    duplicate = []
+    hashes = [row_hash(record) for record in records]
+    known = set(Lesson.objects
+                .filter(start_time__range=(min(record[5] for record in records),
+                                           max(record[5] for record in records)))
+                .exclude(source_hash='')
+                .values_list('source_hash', flat=True))
+    new_records = []
+    for record, source_hash in zip(records, hashes):
+        if source_hash in known:
+            duplicate.append(record[0])
+            continue
+        known.add(source_hash)
+        new_records.append((record, source_hash))
+    planned = new_lessons(new_records, duplicate, dry_run)
+    return planned, sorted(duplicate)
+
+
+def resource_ids(records: List[Tuple[LessonRecord, str]], dry_run: bool) -> Tuple[Dict, ...]:
+    """
+    Ids of professors, rooms and groups of rows, missing ones are created,
+    in dry run they get negative ids, unique for every missing object
+    """
+    professors = {record[2] for record, _hash in records}
+    groups = {record[3] for record, _hash in records}
+    rooms = {record[4] for record, _hash in records}
+    if not dry_run:
+        return get_professors(professors), get_groups(groups), get_rooms(rooms)
+    return (placeholder_ids(find_professors(professors), professors),
+            placeholder_ids(find_groups(groups), groups),
+            placeholder_ids(find_rooms(rooms), rooms))
+
+
+def placeholder_ids(ids: Dict, values: Set) -> Dict:
+    """
+    Gives negative ids to values missing in database, so they can be compared like saved ones
+    :param ids: ids of values found in database, updated in place
+    :param values: all values
+    :return: ids
+    """
+    for number, value in enumerate(sorted(values - ids.keys()), 1):
+        ids[value] = -number
+    return ids
+
+
+def new_lessons(records: List[Tuple[LessonRecord, str]], duplicate: List[int],
+                dry_run: bool) -> List[Tuple[int, Lesson]]:
+    """
+    Lessons of rows not in database, like lessons added in calendar or edited after import
+    :param records: parsed rows with their hashes
+    :param duplicate: indexes of duplicate rows are appended to it
+    :param dry_run: missing professors, rooms and groups are not created
+    :return: pairs (row index, unsaved Lesson)
+    """
+    if not records:
+        return []
+    professors, groups, rooms = resource_ids(records, dry_run)
+    seen = set(Lesson.objects
+               .filter(start_time__range=(min(record[5] for record, _hash in records),
+                                          max(record[5] for record, _hash in records)))
+               .values_list('name', 'professor_id', 'group_id', 'room_id',
+                            'start_time', 'end_time'))
+    lessons = []
+    for (index, name, professor, group, room, start, end), source_hash in records:
+        key = (name, professors[professor], groups[group], rooms[room], start, end)
+        if key in seen:
+            duplicate.append(index)
+            continue
+        seen.add(key)
+        lessons.append((index, Lesson(name=name, professor_id=key[1], group_id=key[2],
+                                      room_id=key[3], start_time=start, end_time=end,
+                                      source_hash=source_hash)))
+    return lessons
+
+
+def forecast_import(data: pd.DataFrame, ext: str) \
+        -> Tuple[int, List[int], List[int], List[ImportConflict]]:
+    """
+    Dry run of parse_data which also forecasts conflicts the new lessons would cause,
+    they are checked against each other and against lessons from the time range of the file
+    :param data: DataFrame with lessons
+    :param ext: File extension: .csv or .xlsx
+    :return: number of lessons which would be added, indexes of incorrect and duplicate rows
+             and conflicts (conflict type, row index, index of other row or Lesson from database)
+    """
+    records, incorrect = parse_records(data, ext)
+    if not records:
+        return 0, incorrect, [], []
+    with transaction.atomic():
+        planned, duplicate = plan_lessons(records, dry_run=True)
+        rows = {id(lesson): index for index, lesson in planned}
+        conflicts = [(c_type, rows[id(lesson)], rows.get(id(other), other))
+                     for c_type, lesson, other, _object_id
+                     in forecast_range_conflicts([lesson for _index, lesson in planned])]
+    return len(planned), incorrect, duplicate, sorted(conflicts, key=lambda conflict: conflict[1])
 
 
 def check_types_excel(row: tuple) -> bool:
@@ -180,51 +646,114 @@ def check_types_excel(row: tuple) -> bool:
     return True
 
 
-def import_students(data: pd.DataFrame) -> Tuple[int, List[int], List[int]]:
+def import_students(data: pd.DataFrame, dry_run: bool = False) \
+        -> Tuple[int, List[int], List[int]]:
     """
         Parse students data and add to database
         :param data: DataFrame with students data
             Accepted format: index_number | name_and_surname | group
-        :return: number of students added
+        :param dry_run: nothing is written, students which would be saved are counted
+        :return: number of students added or updated, indexes of incorrect and duplicate rows
         """
     if len(data.columns) == 3:
-        added_columns = 0
-        incorrect = []
-        duplicate = []
-        for row in data.itertuples():
-            if row.count(nan) != 0 or not students_check_types(row):
-                incorrect.append(row[0])
+        records, incorrect = parse_students(data)
+        added, duplicate = save_students(records, dry_run)
+        return added, incorrect, duplicate
+    raise ImportSizeException
+
+
+def parse_indexes(values: pd.Series) -> np.ndarray:
+    """
+    :param values: index numbers as text or numbers
+    :return: int64 array, 0 where value is not a number from 100000 to 999999
+    """
+    numbers = pd.to_numeric(values.astype(str).str.extract(INDEX_PATTERN)[0]).fillna(0).values
+    return np.where(numbers >= FIRST_INDEX, numbers, 0).astype(np.int64)
+
+
+def parse_students(data: pd.DataFrame) -> Tuple[List[StudentRecord], List[int]]:
+    """
+    Parses whole columns of students data at once
+    :param data: DataFrame with students data
+    :return: parsed correct rows and indexes of incorrect rows
+    """
+    indexes = parse_indexes(data.iloc[:, 0])
+    valid = data.notna().all(axis=1).values & (indexes != 0)
+    valid &= instances(data.iloc[:, 1], str)
+    names = split_names(data.iloc[:, 1])
+    valid &= pd.notna(names)
+    group = Distinct(data.iloc[:, 2])
+    valid &= group.map(lambda values: instances(values, (str, int)), False)
+    records = list(zip(data.index[valid].tolist(),
+                       indexes[valid].tolist(),
+                       names[valid].tolist(),
+                       group.map(lambda values: values.astype(str).values, None)[valid].tolist()))
+    return records, data.index[~valid].tolist()
+
+
+def save_students(records: List[StudentRecord], dry_run: bool = False) \
+        -> Tuple[int, List[int]]:
+    """
+    Adds or updates parsed students in a single transaction, keyed on their index number
+    Groups are resolved for all students at once, students already in database
+    are found with one query over the range of index numbers
+    :param records: parsed rows (row index, index number, (name, surname), group)
+    :param dry_run: nothing is written, students which would be saved are counted
+    :return: number of students added or updated and indexes of duplicate rows,
+             which are in database or whose index number is earlier in the file
+    """
+    if not records:
+        return 0, []
+    duplicate = []
+    created = []
+    renamed = []
+    moved: Dict[int, List[int]] = defaultdict(list)
+    with transaction.atomic():
+        if dry_run:
+            groups = placeholder_ids(find_groups({record[3] for record in records}),
+                                     {record[3] for record in records})
+        else:
+            groups = get_groups({record[3] for record in records})
+        existing = {index: (name, surname, group_id, student_id)
+                    for index, name, surname, group_id, student_id in Student.objects
+                    .filter(index__range=(min(record[1] for record in records),
+                                          max(record[1] for record in records)))
+                    .values_list('index', 'name', 'surname', 'group_id', 'id')}
+        seen = set()
+        for row, index, (name, surname), group in records:
+            if index in seen:
+                duplicate.append(row)
                 continue
-            full_name = row[2].strip().split()
-            if len(full_name) == 2:
-                group = get_group(row[3])
-                _student, created = Student.objects.get_or_create(
-                    name=full_name[0],
-                    surname=full_name[1],
-                    group=group,
-                    index=int(row[1])
-                )
-                if created:
-                    added_columns += 1
-                else:
-                    duplicate.append(row[0])
+            seen.add(index)
+            student = Student(index=index, name=name, surname=surname, group_id=groups[group])
+            if index not in existing:
+                created.append(student)
+            elif existing[index][:3] == (name, surname, student.group_id):
+                duplicate.append(row)
+            elif existing[index][:2] == (name, surname):
+                moved[student.group_id].append(existing[index][3])
             else:
-                incorrect.append(row[0])
-                continue
-        return added_columns, incorrect, duplicate
-    raise ImportSizeException
+                student.id = existing[index][3]
+                renamed.append(student)
+        if dry_run:
+            return len(created) + len(renamed) + sum(map(len, moved.values())), duplicate
+        batch_size = getattr(settings, 'IMPORT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        Student.objects.bulk_create(created, batch_size=batch_size)
+        move_students(moved, batch_size)
+        # changed names are rare fixes of typos
+        for student in renamed:
+            Student.objects.filter(id=student.id).update(name=student.name,
+                                                         surname=student.surname,
+                                                         group_id=student.group_id)
+    return len(created) + len(renamed) + sum(map(len, moved.values())), duplicate
 
 
-def students_check_types(row: tuple) -> bool:
-    """Returns true if row containing students data has correct types"""
-    try:
-        index = int(row[1])
-        if index < 100000 or index > 999999:
-            return False
-    except ValueError:
-        return False
-    if not isinstance(row[2], str):
-        return False
-    if not isinstance(row[3], (str, int)):
-        return False
-    return True
+def move_students(moved: Dict[int, List[int]], batch_size: int):
+    """
+    Saves new groups of students, moves between groups are the usual change between uploads,
+    so students moved to the same group are updated with a single query per batch
+    :param moved: ids of students by id of their new group
+    """
+    for group_id, ids in moved.items():
+        for start in range(0, len(ids), batch_size):
+            Student.objects.filter(id__in=ids[start:start + batch_size]).update(group_id=group_id)
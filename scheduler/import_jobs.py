@@ -0,0 +1,137 @@
+"""Import of big files in background, resumable after the last committed chunk"""
+import datetime as dt
+import os.path
+from typing import Callable, List
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+import scheduler.import_handlers as imp
+from scheduler.models import ImportJob
+
+# directory of default_storage keeping uploaded files until their job is done
+JOBS_DIRECTORY = 'imports'
+
+# indexes of incorrect and duplicate rows kept by a job to be listed
+JOB_ROWS_KEPT = 100
+
+# seconds after which a running job which has not committed a chunk is taken as stalled,
+# unless IMPORT_RUNNING_TIMEOUT is set
+DEFAULT_RUNNING_TIMEOUT = 30 * 60
+
+ERROR_MESSAGES = {
+    imp.ImportSizeException: "Incorrect number of columns",
+    imp.ImportExtensionException: "Extension not supported",
+    imp.ImportCorruptedException: "Corrupted file",
+    UnicodeDecodeError: "File contains weird symbols",
+}
+
+
+def create_import_job(kind: str, file, digest: str = '') -> ImportJob:
+    """
+    Saves uploaded file until its job is done
+    :param kind: ImportJob.SCHEDULE or ImportJob.STUDENTS
+    :param file: uploaded file
+    :param digest: SHA-256 of schedule file, remembered once it is imported
+    :return: job to be queued with queue_import_file
+    """
+    name = default_storage.save(os.path.join(JOBS_DIRECTORY, file.name), file)
+    return ImportJob.objects.create(kind=kind, file=name, original_name=file.name,
+                                    digest=digest)
+
+
+def stalled_jobs() -> Q:
+    """
+    Running jobs whose heartbeat is older than IMPORT_RUNNING_TIMEOUT,
+    their worker died before marking the end, e.g. killed when out of memory
+    """
+    timeout = dt.timedelta(
+        seconds=getattr(settings, 'IMPORT_RUNNING_TIMEOUT', DEFAULT_RUNNING_TIMEOUT))
+    return Q(status=ImportJob.RUNNING) \
+        & (Q(heartbeat__isnull=True) | Q(heartbeat__lt=timezone.now() - timeout))
+
+
+def job_stalled(job: ImportJob) -> bool:
+    """True if job is running but its worker died, it can be resumed then"""
+    return ImportJob.objects.filter(stalled_jobs(), pk=job.id).exists()
+
+
+def reset_failed_job(job: ImportJob) -> bool:
+    """
+    Marks failed or stalled job as queued again,
+    it skips rows of chunks committed before the failure
+    :return: True if job has to be queued with queue_import_file,
+             False if it did not fail or a retry of its task took it over meanwhile
+    """
+    return ImportJob.objects.filter(Q(status=ImportJob.FAILED) | stalled_jobs(), pk=job.id) \
+        .update(status=ImportJob.QUEUED, error='') == 1
+
+
+def keep_rows(kept: str, rows: List[int]) -> str:
+    """Appends rows to comma separated list, until it has JOB_ROWS_KEPT of them"""
+    listed = kept.split(',') if kept else []
+    listed.extend(str(row) for row in rows[:max(JOB_ROWS_KEPT - len(listed), 0)])
+    return ','.join(listed)
+
+
+def error_message(error: Exception) -> str:
+    """Message shown for exception which stopped the job"""
+    for exception, message in ERROR_MESSAGES.items():
+        if isinstance(error, exception):
+            return message
+    return str(error) or type(error).__name__
+
+
+def run_import_job(job_id: int, lessons_added: Callable[[], None] = lambda: None):
+    """
+    Imports file of the job in chunks of IMPORT_CHUNK_SIZE rows,
+    every chunk is committed together with the progress of the job,
+    so the job can resume from the next chunk when it fails
+    :param job_id: id of ImportJob
+    :param lessons_added: called once after lessons were added to schedule,
+                          also when the job fails after some chunks were committed
+    """
+    # queued job, failed one retried by its task or stalled one is claimed by a single run,
+    # a retry and a resume of the same job never import the same chunks twice
+    if not ImportJob.objects.filter(
+            Q(status__in=(ImportJob.QUEUED, ImportJob.FAILED)) | stalled_jobs(), pk=job_id) \
+            .update(status=ImportJob.RUNNING, heartbeat=timezone.now()):
+        return
+    job = ImportJob.objects.get(pk=job_id)
+    ext = os.path.splitext(job.original_name)[1]
+    chunk_size = getattr(settings, 'IMPORT_CHUNK_SIZE', imp.DEFAULT_CHUNK_SIZE)
+    try:
+        for chunk in imp.read_chunks(default_storage.path(job.file), ext, chunk_size,
+                                     job.rows_processed):
+            with transaction.atomic():
+                if job.kind == ImportJob.STUDENTS:
+                    added, incorrect, duplicate = imp.import_students(chunk)
+                else:
+                    added, incorrect, duplicate = imp.parse_data(chunk, ext)
+                job.rows_processed += len(chunk)
+                job.added += added
+                job.incorrect_count += len(incorrect)
+                job.incorrect = keep_rows(job.incorrect, incorrect)
+                job.duplicate_count += len(duplicate)
+                job.duplicate = keep_rows(job.duplicate, duplicate)
+                job.heartbeat = timezone.now()
+                job.save()
+    except Exception as error:
+        ImportJob.objects.filter(pk=job.id).update(status=ImportJob.FAILED,
+                                                   error=error_message(error))
+        # lessons of committed chunks stay in schedule
+        if job.kind == ImportJob.SCHEDULE and job.added:
+            lessons_added()
+        raise
+    job.status = ImportJob.DONE
+    job.save()
+    default_storage.delete(job.file)
+    # students never cause conflicts
+    if job.kind == ImportJob.SCHEDULE and job.added:
+        lessons_added()
+    if job.digest:
+        imp.remember_import(job.digest, job.original_name, job.rows_processed,
+                            job.incorrect_count)
@@ -0,0 +1,231 @@
+"""In-process index of lessons by professor, room and group, sorted by start time"""
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+import datetime
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from scheduler.models import Lesson, Professor, Room, Group, ScheduleState
+
+# Lesson field holding id of the resource, by resource model
+RESOURCE_FIELDS = {Professor: 'professor_id', Room: 'room_id', Group: 'group_id'}
+
+INDEXED_VALUES = ('id', 'start_time', 'end_time', 'professor_id', 'room_id', 'group_id')
+
+# seconds between builds of an index made stale by another process,
+# unless INDEX_REBUILD_INTERVAL is set
+DEFAULT_REBUILD_INTERVAL = 60
+
+
+def intervals_overlap(start1, end1, start2, end2) -> bool:
+    """
+    Check if one time interval started or ended during other
+    :param start1: start of the first interval
+    :param end1: end of the first interval
+    :param start2: start of the second interval
+    :param end2: end of the second interval
+    :return: bool if intervals are conflicting
+    """
+    if start1 <= start2 < end1:
+        return True
+    if end1 >= end2 > start1:
+        return True
+    if start1 >= start2 and end1 <= end2:
+        return True
+    return False
+
+
+class ResourceIntervals:
+    """
+    Lessons of a single professor, room or group as lists sorted by start time
+    A lesson overlapping [start, end] has to start in [start - max_duration, end],
+    so a lookup is a binary search plus a scan of that window only
+    """
+    __slots__ = ('starts', 'ends', 'ids', 'max_duration')
+
+    def __init__(self):
+        self.starts: List[datetime.datetime] = []
+        self.ends: List[datetime.datetime] = []
+        self.ids: List[int] = []
+        self.max_duration = datetime.timedelta(0)
+
+    def add(self, lesson_id: int, start: datetime.datetime, end: datetime.datetime):
+        """Inserts lesson keeping lists sorted by start"""
+        position = bisect_right(self.starts, start)
+        self.starts.insert(position, start)
+        self.ends.insert(position, end)
+        self.ids.insert(position, lesson_id)
+        self.max_duration = max(self.max_duration, end - start)
+
+    def remove(self, lesson_id: int, start: datetime.datetime):
+        """Removes lesson, max_duration is kept as it only widens the scanned window"""
+        position = bisect_left(self.starts, start)
+        while position < len(self.ids) and self.ids[position] != lesson_id:
+            position += 1
+        del self.starts[position], self.ends[position], self.ids[position]
+
+    def overlapping(self, start: datetime.datetime, end: datetime.datetime) -> List[int]:
+        """Ids of lessons overlapping [start, end]"""
+        first = bisect_left(self.starts, start - self.max_duration)
+        last = bisect_right(self.starts, end)
+        return [self.ids[i] for i in range(first, last)
+                if intervals_overlap(self.starts[i], self.ends[i], start, end)]
+
+
+class LessonIndex:
+    """
+    Lessons of every professor, room and group, built from database on first use
+    Kept current by Lesson signals within this process and by refresh() after bulk changes
+    which send no signals, like QuerySet.update() and bulk_create().
+    Changes are applied once their transaction is committed.
+    Valid for the schedule version it was built at, followed as long as
+    every version change comes from this process, stale otherwise
+    """
+
+    def __init__(self):
+        self.version: Optional[int] = None
+        # time.monotonic() of the latest build
+        self.built: Optional[float] = None
+        self.lessons: Dict[int, Tuple] = {}
+        self.resources: Dict[Tuple[str, int], ResourceIntervals] = defaultdict(ResourceIntervals)
+
+    def build(self, version: int):
+        """Loads every lesson from database"""
+        self.reset()
+        for row in Lesson.objects.values_list(*INDEXED_VALUES).iterator():
+            self.add(row)
+        self.version = version
+        self.built = time.monotonic()
+
+    def reset(self):
+        """Drops the index, it is built again on next get_index()"""
+        self.version = None
+        self.built = None
+        self.lessons = {}
+        self.resources = defaultdict(ResourceIntervals)
+
+    def add(self, row: Tuple):
+        """Adds or replaces lesson given as tuple of INDEXED_VALUES"""
+        lesson_id, start, end, *resource_ids = row
+        self.discard(lesson_id)
+        self.lessons[lesson_id] = row
+        for field, object_id in zip(INDEXED_VALUES[3:], resource_ids):
+            self.resources[(field, object_id)].add(lesson_id, start, end)
+
+    def discard(self, lesson_id: int):
+        """Removes lesson if it is indexed"""
+        row = self.lessons.pop(lesson_id, None)
+        if row is None:
+            return
+        _lesson_id, start, _end, *resource_ids = row
+        for field, object_id in zip(INDEXED_VALUES[3:], resource_ids):
+            self.resources[(field, object_id)].remove(lesson_id, start)
+
+    def refresh(self, lesson_ids: Iterable[int]):
+        """Reloads given lessons from database, removed ones are dropped"""
+        if self.version is None:
+            return
+        lesson_ids = set(lesson_ids)
+        for lesson_id in lesson_ids:
+            self.discard(lesson_id)
+        for row in Lesson.objects.filter(id__in=lesson_ids).values_list(*INDEXED_VALUES):
+            self.add(row)
+
+    def lookup(self, field: str, object_id: int, start: datetime.datetime,
+               end: datetime.datetime) -> List[int]:
+        """Ids of lessons overlapping [start, end] whose field equals object_id"""
+        intervals = self.resources.get((field, object_id))
+        return intervals.overlapping(start, end) if intervals else []
+
+    def overlapping(self, resource, start: datetime.datetime,
+                    end: datetime.datetime) -> List[int]:
+        """
+        :param resource: Professor, Room or Group
+        :param start: start of the time window
+        :param end: end of the time window
+        :return: ids of lessons of resource overlapping the time window
+        """
+        return self.lookup(RESOURCE_FIELDS[type(resource)], resource.id, start, end)
+
+
+_INDEX = LessonIndex()
+
+
+def get_index() -> Optional[LessonIndex]:
+    """
+    Index of lessons, built on first use
+    None when schedule was changed by another process, then callers use a windowed query.
+    Stale index is built again at most once every INDEX_REBUILD_INTERVAL seconds,
+    so changes made by other processes don't cost a full build each
+    """
+    version = ScheduleState.load().version
+    if _INDEX.version == version:
+        return _INDEX
+    interval = getattr(settings, 'INDEX_REBUILD_INTERVAL', DEFAULT_REBUILD_INTERVAL)
+    if _INDEX.built is None or time.monotonic() - _INDEX.built >= interval:
+        _INDEX.build(version)
+        return _INDEX
+    return None
+
+
+def overlapping(resource, start: datetime.datetime, end: datetime.datetime) -> List[int]:
+    """Ids of lessons of Professor, Room or Group overlapping [start, end]"""
+    index = get_index()
+    if index is not None:
+        return index.overlapping(resource, start, end)
+    return [lesson_id for lesson_id, lesson_start, lesson_end in Lesson.objects
+            .filter(**{RESOURCE_FIELDS[type(resource)]: resource.id},
+                    start_time__lte=end, end_time__gte=start)
+            .order_by('start_time').values_list('id', 'start_time', 'end_time')
+            if intervals_overlap(lesson_start, lesson_end, start, end)]
+
+
+def lessons_changed(lesson_ids: Optional[Iterable[int]] = None):
+    """
+    Hook for bulk changes of lessons, which send no signals,
+    applied once the transaction is committed
+    :param lesson_ids: ids of changed, created or removed lessons,
+                       None when not known, like after bulk_create(), drops the whole index
+    """
+    if lesson_ids is None:
+        transaction.on_commit(_INDEX.reset)
+    else:
+        lesson_ids = set(lesson_ids)
+        transaction.on_commit(lambda: _INDEX.refresh(lesson_ids))
+
+
+def lesson_saved(instance: Lesson, **_kwargs):
+    """post_save receiver of Lesson, saves rolled back never reach the index"""
+    row = tuple(getattr(instance, value) for value in INDEXED_VALUES)
+
+    def add():
+        if _INDEX.version is not None:
+            _INDEX.add(row)
+    transaction.on_commit(add)
+
+
+def lesson_deleted(instance: Lesson, **_kwargs):
+    """post_delete receiver of Lesson"""
+    lesson_id = instance.id
+    transaction.on_commit(lambda: _INDEX.discard(lesson_id))
+
+
+def schedule_state_saved(instance: ScheduleState, created: bool, **_kwargs):
+    """
+    post_save receiver of ScheduleState
+    Lessons changed in this process are applied on commit before it,
+    so the next version is followed then.
+    A new state row means a new database, like in tests, and the index is dropped
+    """
+    if created:
+        _INDEX.reset()
+        return
+    version = instance.version
+
+    def follow():
+        if _INDEX.version is not None and version == _INDEX.version + 1:
+            _INDEX.version = version
+    transaction.on_commit(follow)
@@ -0,0 +1,82 @@
+"""Command measuring conflicts, import and export on synthetic schedules"""
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from scheduler.conflicts_checker import db_conflicts, conflicts_diff
+from scheduler.export_handlers import export_to_csv, export_to_excel
+from scheduler.import_handlers import import_csv, import_excel
+from scheduler.models import Conflict
+from scheduler.synthetic import generate_lessons, to_csv_frame, to_excel_frame, \
+    University
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+class Command(BaseCommand):
+    """
+    Benchmark of the schedule pipeline on synthetic schedules of growing size
+    Every size runs in its own transaction which is rolled back, database is left unchanged
+    """
+    help = "Times import_csv, import_excel, db_conflicts, conflicts_diff, export_to_csv " \
+           "and export_to_excel on synthetic schedules"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                            help="Numbers of lessons")
+        parser.add_argument('--conflict-rate', type=float, default=0.01)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', help="Write results to this file as JSON")
+
+    def handle(self, *args, **options):
+        results = []
+        for size in options['sizes']:
+            results.extend(self.run(size, options['conflict_rate'], options['seed']))
+        if options['json']:
+            with open(options['json'], 'w') as output:
+                json.dump({'engine': getattr(settings, 'CONFLICTS_ENGINE', 'python'),
+                           'database': settings.DATABASES['default']['ENGINE'],
+                           'results': results}, output, indent=2)
+
+    def run(self, size: int, conflict_rate: float, seed: int) -> list:
+        """Measures every operation on schedule with size lessons"""
+        # scale resources with size so that the schedule stays feasible
+        schedule = generate_lessons(University(professors=max(size // 100, 10),
+                                               rooms=max(size // 150, 10),
+                                               groups=max(size // 120, 10), weeks=15),
+                                    size, conflict_rate, seed=seed)
+        first = min(lesson[0] for lesson in schedule)
+        last = max(lesson[1] for lesson in schedule)
+        self.stdout.write("{} lessons".format(len(schedule)))
+        results = []
+
+        def measure(operation, function, *args):
+            start = time.perf_counter()
+            result = function(*args)
+            elapsed = time.perf_counter() - start
+            results.append({'size': size, 'lessons': len(schedule), 'operation': operation,
+                            'seconds': round(elapsed, 4)})
+            self.stdout.write("    {:<18} {:>10.3f} s".format(operation, elapsed))
+            return result
+
+        with transaction.atomic():
+            with transaction.atomic():
+                measure('import_excel', import_excel, to_excel_frame(schedule))
+                transaction.set_rollback(True)
+            measure('import_csv', import_csv, to_csv_frame(schedule))
+            measure('db_conflicts', db_conflicts)
+            current = list(Conflict.objects.all())
+            # as if half of the conflicts were new
+            measure('conflicts_diff', conflicts_diff, current[::2], current)
+            # csv export is streamed, so it is measured until its last line
+            measure('export_to_csv', lambda *period: sum(map(len, export_to_csv(*period))),
+                    first, last)
+            temp_file = measure('export_to_excel', export_to_excel, first, last)
+            temp_file.close()
+            os.unlink(temp_file.name)
+            transaction.set_rollback(True)
+        return results
@@ -0,0 +1,50 @@
+"""Command measuring how long finding conflicts takes"""
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from scheduler.conflicts_checker import find_conflicts, find_conflicts_array, \
+    find_conflicts_parallel, CONFLICT_RESOURCES
+from scheduler.models import Lesson
+
+
+class Command(BaseCommand):
+    """Benchmark of conflicts search on lessons from database, nothing is written"""
+    help = "Times finding conflicts by sweep, numpy and parallel search with growing " \
+           "number of workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Maximal number of workers of parallel search")
+
+    def handle(self, *args, **options):
+        lessons = list(Lesson.objects.all())
+        rows = [(lesson.id, lesson.start_time, lesson.end_time,
+                 *(getattr(lesson, field) for _c_type, field in CONFLICT_RESOURCES))
+                for lesson in lessons]
+        cpus = os.cpu_count() or 1
+        self.stdout.write("{} lessons, {} CPUs".format(len(rows), cpus))
+        sweep_time = self.measure("sweep", lambda: find_conflicts(lessons))
+        self.measure("numpy", lambda: find_conflicts_array(rows))
+        if cpus <= 1:
+            # workers would run one after another, only the cost of the pool would be measured
+            self.stdout.write(self.style.WARNING("parallel search skipped, only one CPU"))
+            return
+        workers = 1
+        while workers <= options['workers']:
+            parallel_time = self.measure("parallel, {} workers".format(workers),
+                                         lambda: find_conflicts_parallel(rows, workers))
+            speedup = "    speedup over sweep: {:.2f}x".format(sweep_time / parallel_time)
+            if parallel_time > sweep_time:
+                speedup = self.style.WARNING(speedup + ", slower than sweep")
+            self.stdout.write(speedup)
+            workers *= 2
+
+    def measure(self, name, function) -> float:
+        """Runs function once and prints its time and number of conflicts found"""
+        start = time.perf_counter()
+        conflicts = function()
+        elapsed = time.perf_counter() - start
+        self.stdout.write("{:<24} {:>8.3f} s, {} conflicts".format(name, elapsed, len(conflicts)))
+        return elapsed
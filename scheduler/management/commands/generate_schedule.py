@@ -0,0 +1,53 @@
+"""Command generating synthetic schedule"""
+import datetime as dt
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from scheduler.synthetic import generate_lessons, to_csv_frame, to_excel_frame, \
+    save_to_database, University
+from scheduler.task import queue_conflicts_recompute
+
+
+class Command(BaseCommand):
+    """Generates schedule of a synthetic university into csv/xlsx file or database"""
+    help = "Generates synthetic schedule with given number of professors, rooms, groups " \
+           "and lessons, and the given fraction of conflicting lessons"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--professors', type=int, default=100)
+        parser.add_argument('--rooms', type=int, default=60)
+        parser.add_argument('--groups', type=int, default=80)
+        parser.add_argument('--weeks', type=int, default=15)
+        parser.add_argument('--lessons', type=int, default=10000)
+        parser.add_argument('--conflict-rate', type=float, default=0.01,
+                            help="Fraction of lessons in conflict with another lesson")
+        parser.add_argument('--seed', type=int, default=None)
+        # date.fromisoformat is missing before Python 3.7
+        parser.add_argument('--start', default=None,
+                            type=lambda value: dt.datetime.strptime(value, '%Y-%m-%d').date(),
+                            help="First day of schedule YYYY-MM-DD, next Monday by default")
+        parser.add_argument('--output', help="Write lessons to .csv or .xlsx file")
+        parser.add_argument('--database', action='store_true',
+                            help="Add lessons to database")
+
+    def handle(self, *args, **options):
+        if not options['output'] and not options['database']:
+            raise CommandError("Give --output file or --database")
+        schedule = generate_lessons(
+            University(options['professors'], options['rooms'], options['groups'],
+                       options['weeks']),
+            options['lessons'], options['conflict_rate'], options['start'], options['seed'])
+        if options['output']:
+            ext = os.path.splitext(options['output'])[1]
+            if ext == '.csv':
+                to_csv_frame(schedule).to_csv(options['output'], index=False)
+            elif ext == '.xlsx':
+                to_excel_frame(schedule).to_excel(options['output'], index=False)
+            else:
+                raise CommandError("Output file has to be .csv or .xlsx")
+            self.stdout.write("Wrote {} lessons to {}".format(len(schedule), options['output']))
+        if options['database']:
+            self.stdout.write("Added {} lessons to database".format(save_to_database(schedule)))
+            # new version of schedule, as after upload, conflicts are looked for by the task
+            queue_conflicts_recompute()
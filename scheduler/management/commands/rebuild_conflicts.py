@@ -0,0 +1,19 @@
+"""Command rebuilding the whole conflicts table"""
+from django.core.management.base import BaseCommand
+
+from scheduler.conflicts_checker import db_conflicts
+from scheduler.models import Conflict, ScheduleState
+
+
+class Command(BaseCommand):
+    """Maintenance command finding conflicts for every lesson in database"""
+    help = "Drops all conflicts and finds them again for every lesson"
+
+    def handle(self, *args, **options):
+        version = ScheduleState.load().version
+        db_conflicts()
+        # conflicts are current unless schedule changed in the meantime
+        ScheduleState.objects.filter(pk=1, version=version) \
+            .update(conflicts_version=version, conflicts_status=ScheduleState.IDLE,
+                    conflicts_progress=100)
+        self.stdout.write("Found {} conflicts".format(Conflict.objects.count()))
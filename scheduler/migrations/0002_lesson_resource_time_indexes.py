@@ -0,0 +1,25 @@
+# Generated by Django 2.1.9 on 2026-10-18 08:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['professor', 'start_time'], name='scheduler_l_profess_3a9b06_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['room', 'start_time'], name='scheduler_l_room_id_895269_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['group', 'start_time'], name='scheduler_l_group_i_b36852_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.1.9 on 2026-10-18 08:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0002_lesson_resource_time_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.IntegerField(default=0, verbose_name='Schedule version')),
+                ('conflicts_version', models.IntegerField(default=0, verbose_name='Conflicts version')),
+                ('conflicts_status', models.CharField(choices=[('IDLE', 'IDLE'), ('QUEUED', 'QUEUED'), ('RUNNING', 'RUNNING'), ('FAILED', 'FAILED')], default='IDLE', max_length=20)),
+                ('conflicts_progress', models.IntegerField(default=100, verbose_name='Conflicts progress')),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.9 on 2026-10-18 08:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0003_schedulestate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schedulestate',
+            name='changed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
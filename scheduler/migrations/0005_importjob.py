@@ -0,0 +1,32 @@
+# Generated by Django 2.1.9 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0004_schedulestate_changed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('SCHEDULE', 'SCHEDULE'), ('STUDENTS', 'STUDENTS')], max_length=20)),
+                ('file', models.CharField(max_length=255, verbose_name='File')),
+                ('original_name', models.CharField(max_length=255, verbose_name='Uploaded file')),
+                ('status', models.CharField(choices=[('QUEUED', 'QUEUED'), ('RUNNING', 'RUNNING'), ('DONE', 'DONE'), ('FAILED', 'FAILED')], default='QUEUED', max_length=20)),
+                ('rows_processed', models.IntegerField(default=0, verbose_name='Rows processed')),
+                ('added', models.IntegerField(default=0, verbose_name='Added')),
+                ('incorrect_count', models.IntegerField(default=0, verbose_name='Incorrect rows')),
+                ('duplicate_count', models.IntegerField(default=0, verbose_name='Duplicate rows')),
+                ('incorrect', models.TextField(blank=True, default='')),
+                ('duplicate', models.TextField(blank=True, default='')),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.1.9 on 2026-10-18 09:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0005_importjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportedFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='SHA-256')),
+                ('original_name', models.CharField(max_length=255, verbose_name='Uploaded file')),
+                ('rows', models.IntegerField(default=0, verbose_name='Rows')),
+                ('incorrect_count', models.IntegerField(default=0, verbose_name='Incorrect rows')),
+                ('schedule_version', models.IntegerField(verbose_name='Schedule version')),
+                ('imported', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='digest',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='SHA-256'),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='source_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=32, verbose_name='Source row hash'),
+        ),
+    ]
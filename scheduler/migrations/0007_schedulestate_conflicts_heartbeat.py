@@ -0,0 +1,18 @@
+# Generated by Django 2.1.9 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0006_source_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schedulestate',
+            name='conflicts_heartbeat',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,4 +1,6 @@
 """Utilities for working with model elements"""
+from typing import Dict, Iterable, Optional, Set, Tuple
+
 from scheduler.models import Professor, Room, Group
 
 
@@ -18,3 +20,86 @@ def get_group(name: str) -> Group:
     """Gets group from database or creates a new object and returns it"""
     group, _created = Group.objects.get_or_create(name=name)
     return group
+
+
+def find_professor(name: str, surname: str) -> Optional[Professor]:
+    """Gets professor from database without creating it, None if there is no such professor"""
+    return Professor.objects.filter(name=name, surname=surname).first()
+
+
+def find_room(number: str) -> Optional[Room]:
+    """Gets room from database without creating it, None if there is no such room"""
+    return Room.objects.filter(number=number).first()
+
+
+def find_group(name: str) -> Optional[Group]:
+    """Gets group from database without creating it, None if there is no such group"""
+    return Group.objects.filter(name=name).first()
+
+
+def find_professors(names: Set[Tuple[str, str]]) -> Dict[Tuple[str, str], int]:
+    """
+    Bulk version of find_professor, professors missing in database are left out
+    :param names: pairs (name, surname)
+    :return: professor id by (name, surname)
+    """
+    found: Dict[Tuple[str, str], int] = {}
+    for professor_id, name, surname in Professor.objects \
+            .filter(name__in={name for name, _surname in names},
+                    surname__in={surname for _name, surname in names}) \
+            .order_by('id').values_list('id', 'name', 'surname'):
+        # the oldest professor is used if the name repeats
+        if (name, surname) in names:
+            found.setdefault((name, surname), professor_id)
+    return found
+
+
+def get_professors(names: Set[Tuple[str, str]]) -> Dict[Tuple[str, str], int]:
+    """
+    Bulk version of get_professor, creates professors missing in database
+    :param names: pairs (name, surname)
+    :return: professor id by (name, surname)
+    """
+    professors = find_professors(names)
+    missing = names - professors.keys()
+    if missing:
+        Professor.objects.bulk_create(Professor(name=name, surname=surname)
+                                      for name, surname in missing)
+        professors.update(find_professors(missing))
+    return professors
+
+
+def _find_unique(model, field: str, values: Iterable[str]) -> Dict[str, int]:
+    """Ids of objects by the unique field, objects missing in database are left out"""
+    return dict(model.objects.filter(**{field + '__in': set(values)}).values_list(field, 'id'))
+
+
+def _get_unique(model, field: str, values: Iterable[str]) -> Dict[str, int]:
+    """Ids of objects by the unique field, objects missing in database are created"""
+    values = set(values)
+    objects = _find_unique(model, field, values)
+    missing = values - objects.keys()
+    if missing:
+        model.objects.bulk_create(model(**{field: value}) for value in missing)
+        objects.update(_find_unique(model, field, missing))
+    return objects
+
+
+def find_rooms(numbers: Iterable[str]) -> Dict[str, int]:
+    """Bulk version of find_room, returns room id by number"""
+    return _find_unique(Room, 'number', numbers)
+
+
+def get_rooms(numbers: Iterable[str]) -> Dict[str, int]:
+    """Bulk version of get_room, returns room id by number"""
+    return _get_unique(Room, 'number', numbers)
+
+
+def find_groups(names: Iterable[str]) -> Dict[str, int]:
+    """Bulk version of find_group, returns group id by name"""
+    return _find_unique(Group, 'name', names)
+
+
+def get_groups(names: Iterable[str]) -> Dict[str, int]:
+    """Bulk version of get_group, returns group id by name"""
+    return _get_unique(Group, 'name', names)
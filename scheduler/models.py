@@ -45,6 +45,9 @@ class Professor(models.Model):
     def __str__(self):
         return self.name + " " + self.surname
 
+    # defining __eq__ drops the inherited __hash__, Collector of delete() keeps models in sets
+    __hash__ = models.Model.__hash__
+
     def __eq__(self, other):
         if not isinstance(other, models.Model):
             return False
@@ -62,6 +65,8 @@ class Room(models.Model):
     def __str__(self):
         return str(self.number)
 
+    __hash__ = models.Model.__hash__
+
     def __eq__(self, other):
         if not isinstance(other, models.Model):
             return False
@@ -78,6 +83,8 @@ class Group(models.Model):
     def __str__(self):
         return str(self.name)
 
+    __hash__ = models.Model.__hash__
+
     def __eq__(self, other):
         if not isinstance(other, models.Model):
             return False
@@ -97,16 +104,27 @@ class Lesson(models.Model):
     group = models.ForeignKey(Group, related_name='lessons', on_delete=models.CASCADE)
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
+    # hash of the imported row the lesson was created from, empty once the lesson is edited
+    source_hash = models.CharField("Source row hash", max_length=32, blank=True, default='',
+                                   db_index=True)
 
     group_color = property(lambda self: color_from_id(self.group_id, True))
     room_color = property(lambda self: color_from_id(self.room_id))
 
     class Meta:
         unique_together = ('name', 'professor', 'room', 'group', 'start_time', 'end_time',)
+        # used when looking for lessons of the same resource overlapping in time
+        indexes = [
+            models.Index(fields=['professor', 'start_time']),
+            models.Index(fields=['room', 'start_time']),
+            models.Index(fields=['group', 'start_time']),
+        ]
 
     def __str__(self):
         return self.name
 
+    __hash__ = models.Model.__hash__
+
     def __eq__(self, other):
         if not isinstance(other, models.Model):
             return False
@@ -155,6 +173,8 @@ class Conflict(models.Model):
         return str(self.first_lesson) + " and " + str(self.second_lesson) + " " \
                + self.conflict_type + " " + str(self.object_id)
 
+    __hash__ = models.Model.__hash__
+
     def __eq__(self, other):
         if not isinstance(other, models.Model):
             return False
@@ -171,3 +191,104 @@ class Conflict(models.Model):
             except Lesson.DoesNotExist:
                 return False
         return False
+
+
+class ScheduleState(models.Model):
+    """Single row holding version of schedule and state of conflicts recomputation"""
+    IDLE = 'IDLE'
+    QUEUED = 'QUEUED'
+    RUNNING = 'RUNNING'
+    FAILED = 'FAILED'
+    CONFLICTS_STATUS = (
+        (IDLE, IDLE),
+        (QUEUED, QUEUED),
+        (RUNNING, RUNNING),
+        (FAILED, FAILED)
+    )
+    # incremented with every change of lessons
+    version = models.IntegerField("Schedule version", default=0)
+    # version of schedule for which conflicts in database were found
+    conflicts_version = models.IntegerField("Conflicts version", default=0)
+    conflicts_status = models.CharField(choices=CONFLICTS_STATUS, max_length=20, default=IDLE)
+    conflicts_progress = models.IntegerField("Conflicts progress", default=100)
+    # time of the latest change of lessons, recomputation waits until changes stop
+    changed = models.DateTimeField(null=True, blank=True)
+    # time the running recomputation started or reported progress,
+    # it is taken as dead when this gets older than CONFLICTS_RUNNING_TIMEOUT
+    conflicts_heartbeat = models.DateTimeField(null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def load(cls, for_update=False):
+        """Gets the only row, creating it when needed. Locks it if for_update is set"""
+        queryset = cls.objects.select_for_update() if for_update else cls.objects
+        state, _created = queryset.get_or_create(pk=1)
+        return state
+
+    def __str__(self):
+        return "Schedule " + str(self.version) + ", conflicts " + str(self.conflicts_version) \
+               + " " + self.conflicts_status
+
+
+class ImportJob(models.Model):
+    """
+    Import of an uploaded file in background, committed chunk by chunk
+    together with its progress, so a failed job resumes after the last committed chunk
+    """
+    SCHEDULE = 'SCHEDULE'
+    STUDENTS = 'STUDENTS'
+    KINDS = (
+        (SCHEDULE, SCHEDULE),
+        (STUDENTS, STUDENTS)
+    )
+    QUEUED = 'QUEUED'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+    STATUS = (
+        (QUEUED, QUEUED),
+        (RUNNING, RUNNING),
+        (DONE, DONE),
+        (FAILED, FAILED)
+    )
+    kind = models.CharField(choices=KINDS, max_length=20)
+    # name of the uploaded file in default_storage, deleted once the job is done
+    file = models.CharField("File", max_length=255)
+    original_name = models.CharField("Uploaded file", max_length=255)
+    # SHA-256 of schedule file, remembered as ImportedFile once the job is done
+    digest = models.CharField("SHA-256", max_length=64, blank=True, default='')
+    status = models.CharField(choices=STATUS, max_length=20, default=QUEUED)
+    # rows of committed chunks, the job resumes from the next one
+    rows_processed = models.IntegerField("Rows processed", default=0)
+    added = models.IntegerField("Added", default=0)
+    incorrect_count = models.IntegerField("Incorrect rows", default=0)
+    duplicate_count = models.IntegerField("Duplicate rows", default=0)
+    # comma separated indexes of the first incorrect and duplicate rows
+    incorrect = models.TextField(blank=True, default='')
+    duplicate = models.TextField(blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    # time the running job was claimed or committed a chunk,
+    # it is taken as stalled when this gets older than IMPORT_RUNNING_TIMEOUT
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.kind + " import of " + self.original_name + " " + self.status
+
+
+class ImportedFile(models.Model):
+    """
+    Schedule file imported before, identified by SHA-256 of its content
+    An identical upload is not imported again while schedule is unchanged since
+    """
+    digest = models.CharField("SHA-256", max_length=64, unique=True)
+    original_name = models.CharField("Uploaded file", max_length=255)
+    rows = models.IntegerField("Rows", default=0)
+    incorrect_count = models.IntegerField("Incorrect rows", default=0)
+    # version of schedule right after the import
+    schedule_version = models.IntegerField("Schedule version")
+    imported = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.original_name + " " + self.digest
@@ -0,0 +1,150 @@
+"""Synthetic schedules for benchmarks and tests"""
+import datetime as dt
+import random
+from typing import List, NamedTuple, Optional, Set, Tuple
+
+import pandas as pd
+
+from scheduler.interval_index import lessons_changed
+from scheduler.model_util import get_professors, get_rooms, get_groups
+from scheduler.models import Lesson
+
+FIRST_NAMES = ["Anna", "Piotr", "Maria", "Jan", "Katarzyna", "Tomasz", "Agnieszka", "Marek",
+               "Joanna", "Pawel", "Ewa", "Michal", "Barbara", "Krzysztof", "Zofia", "Adam"]
+SURNAMES = ["Nowak", "Kowalski", "Wisniewski", "Wojcik", "Kowalczyk", "Kaminski", "Lewandowski",
+            "Zielinski", "Szymanski", "Wozniak", "Dabrowski", "Kozlowski", "Jankowski", "Mazur"]
+SUBJECTS = ["Algebra", "Analysis", "Physics", "Circuits Theory", "Programming", "Databases",
+            "Statistics", "Operating Systems", "Networks", "Electronics", "Mechanics", "English"]
+
+# lessons start at these times and last 90 minutes, five days a week
+SLOT_STARTS = [dt.time(8, 0), dt.time(9, 45), dt.time(11, 30), dt.time(13, 15),
+               dt.time(15, 0), dt.time(16, 45), dt.time(18, 30)]
+LESSON_DURATION = dt.timedelta(minutes=90)
+DAYS_PER_WEEK = 5
+
+# attempts to find a free professor, room and group before giving up on a lesson
+ATTEMPTS = 20
+
+COLUMNS = ['Date', 'Start time', 'End time', 'Lesson', 'Professor', 'Group', 'Room']
+
+
+def professor_name(number: int) -> str:
+    """Unique 'name surname' of professor with given number"""
+    name = FIRST_NAMES[number % len(FIRST_NAMES)]
+    surname = SURNAMES[number // len(FIRST_NAMES) % len(SURNAMES)]
+    cycle = number // (len(FIRST_NAMES) * len(SURNAMES))
+    return name + " " + surname + (str(cycle) if cycle else "")
+
+
+def room_number(number: int) -> str:
+    """Unique room number like 3.27 or 3.27a"""
+    building, room = divmod(number, 40)
+    suffix = "" if building < 5 else chr(ord('a') + building // 5 - 1)
+    return "{}.{:02d}{}".format(building % 5 + 1, room + 10, suffix)
+
+
+class University(NamedTuple):
+    """Sizes of a synthetic university"""
+    professors: int
+    rooms: int
+    groups: int
+    weeks: int
+
+
+def lesson_resources(slot: int, professor: int, room: int, group: int) -> Set[Tuple]:
+    """Resources busy because of the lesson"""
+    return {(slot, 'PROFESSOR', professor), (slot, 'ROOM', room), (slot, 'GROUP', group)}
+
+
+def free_lesson(rand: random.Random, university: University, slots: int,
+                busy: Set[Tuple]) -> Optional[Tuple[int, int, int, int]]:
+    """Random slot, professor, room and group not busy in it or None when not found"""
+    for _ in range(ATTEMPTS):
+        lesson = (rand.randrange(slots), rand.randrange(university.professors),
+                  rand.randrange(university.rooms), rand.randrange(university.groups))
+        if not lesson_resources(*lesson) & busy:
+            return lesson
+    return None
+
+
+def conflicting_lesson(rand: random.Random, university: University,
+                       taken: List[Tuple[int, int, int, int]]) -> Tuple[int, int, int, int]:
+    """Random lesson sharing slot and one of professor, room or group with a taken lesson"""
+    lesson = rand.choice(taken)
+    shared = rand.randrange(1, 4)
+    return (lesson[0],
+            lesson[1] if shared == 1 else rand.randrange(university.professors),
+            lesson[2] if shared == 2 else rand.randrange(university.rooms),
+            lesson[3] if shared == 3 else rand.randrange(university.groups))
+
+
+def generate_lessons(university: University, lessons: int, conflict_rate: float = 0.0,
+                     start: Optional[dt.date] = None, seed: Optional[int] = None) -> List[Tuple]:
+    """
+    Generates schedule of a synthetic university
+    Lessons are placed into free slots of professor, room and group,
+    except for conflict_rate of them which reuse a professor, room or group busy in that slot
+    :param university: numbers of professors, rooms, groups and weeks the schedule spans
+    :param lessons: number of lessons
+    :param conflict_rate: fraction of lessons in conflict with another lesson
+    :param start: first day of schedule, next Monday by default
+    :param seed: seed of random generator, to get the same schedule again
+    :return: list of tuples (start, end, subject, professor, group, room), lessons
+             which could not be placed without conflict are skipped
+    """
+    rand = random.Random(seed)
+    if start is None:
+        today = dt.date.today()
+        start = today + dt.timedelta(days=7 - today.weekday())
+    slots = [dt.datetime.combine(start + dt.timedelta(weeks=week, days=day), slot_start)
+             for week in range(university.weeks) for day in range(DAYS_PER_WEEK)
+             for slot_start in SLOT_STARTS]
+    busy: Set[Tuple] = set()
+    taken: List[Tuple[int, int, int, int]] = []
+    schedule = []
+    for number in range(lessons):
+        if taken and rand.random() < conflict_rate:
+            lesson = conflicting_lesson(rand, university, taken)
+        else:
+            lesson = free_lesson(rand, university, len(slots), busy)
+            if lesson is None:
+                continue
+        busy.update(lesson_resources(*lesson))
+        taken.append(lesson)
+        slot, professor, room, group = lesson
+        schedule.append((slots[slot], slots[slot] + LESSON_DURATION,
+                         SUBJECTS[number % len(SUBJECTS)] + " " + str(number),
+                         professor_name(professor), str(group + 1), room_number(room)))
+    return schedule
+
+
+def to_csv_frame(schedule: List[Tuple]) -> pd.DataFrame:
+    """Lessons as DataFrame read from csv file, Date: DD-MM-YY  Time: HH:MM"""
+    return pd.DataFrame([(start.strftime("%d-%m-%y"), start.strftime("%H:%M"),
+                          end.strftime("%H:%M"), subject, professor, group, room)
+                         for start, end, subject, professor, group, room in schedule],
+                        columns=COLUMNS)
+
+
+def to_excel_frame(schedule: List[Tuple]) -> pd.DataFrame:
+    """Lessons as DataFrame read from excel file, with excel date and time types"""
+    return pd.DataFrame([(pd.Timestamp(start.date()), start.time(), end.time(),
+                          subject, professor, group, room)
+                         for start, end, subject, professor, group, room in schedule],
+                        columns=COLUMNS)
+
+
+def save_to_database(schedule: List[Tuple]) -> int:
+    """
+    Adds lessons to database
+    :return: number of lessons added
+    """
+    professors = get_professors({tuple(lesson[3].split()) for lesson in schedule})
+    groups = get_groups({lesson[4] for lesson in schedule})
+    rooms = get_rooms({lesson[5] for lesson in schedule})
+    created = Lesson.objects.bulk_create(
+        [Lesson(name=subject, professor_id=professors[tuple(professor.split())],
+                room_id=rooms[room], group_id=groups[group], start_time=start, end_time=end)
+         for start, end, subject, professor, group, room in schedule])
+    lessons_changed()
+    return len(created)
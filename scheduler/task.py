@@ -29,3 +29,128 @@ def notify_professors():
             sorted_lessons = sorted(professor_lessons, key=lambda k: k.start_time)
             mail.send_messages(subject='Lesson notification', template='email.html',
                                context={'lessons': sorted_lessons}, to_emails=[professor.email])
+
+
+# seconds after which a run of recompute_conflicts not heard of is taken as dead,
+# unless CONFLICTS_RUNNING_TIMEOUT is set
+DEFAULT_RUNNING_TIMEOUT = 30 * 60
+
+
+def recompute_running(state) -> bool:
+    """
+    True if recompute_conflicts is running, a run whose heartbeat is older than
+    CONFLICTS_RUNNING_TIMEOUT is taken as dead, as its worker stopped before marking the end
+    """
+    from django.conf import settings
+    from django.utils import timezone
+    from scheduler.models import ScheduleState
+    if state.conflicts_status != ScheduleState.RUNNING:
+        return False
+    timeout = getattr(settings, 'CONFLICTS_RUNNING_TIMEOUT', DEFAULT_RUNNING_TIMEOUT)
+    return state.conflicts_heartbeat is not None \
+        and (timezone.now() - state.conflicts_heartbeat).total_seconds() < timeout
+
+
+@app.task(name="recompute_conflicts")
+def recompute_conflicts(debounce=True):
+    """
+    Find all conflicts until they match the latest version of schedule
+    Waits until schedule has not changed for CONFLICTS_RECOMPUTE_DELAY seconds,
+    unless debounce is False. Schedule changes made during a run are coalesced
+    into one follow-up run, a run started elsewhere is never duplicated,
+    unless it is dead according to recompute_running
+    """
+    from django.conf import settings
+    from django.db import transaction
+    from django.utils import timezone
+    from scheduler.conflicts_checker import db_conflicts
+    from scheduler.models import ScheduleState
+    delay = getattr(settings, 'CONFLICTS_RECOMPUTE_DELAY', 0)
+    state_query = ScheduleState.objects.filter(pk=1)
+    running = False
+    while True:
+        with transaction.atomic():
+            state = ScheduleState.load(for_update=True)
+            if state.conflicts_version == state.version:
+                state.conflicts_status = ScheduleState.IDLE
+                state.conflicts_progress = 100
+                state.save()
+                return
+            if not running and recompute_running(state):
+                return
+            quiet = (timezone.now() - state.changed).total_seconds() if state.changed else delay
+            if debounce and quiet < delay:
+                state.conflicts_status = ScheduleState.QUEUED
+                state.save()
+                transaction.on_commit(lambda: recompute_conflicts.apply_async(
+                    countdown=delay - quiet))
+                return
+            version = state.version
+            state.conflicts_status = ScheduleState.RUNNING
+            state.conflicts_progress = 0
+            state.conflicts_heartbeat = timezone.now()
+            state.save()
+            running = True
+        try:
+            db_conflicts(progress=lambda percent: state_query.update(
+                conflicts_progress=percent, conflicts_heartbeat=timezone.now()))
+        except Exception:
+            state_query.update(conflicts_status=ScheduleState.FAILED)
+            raise
+        state_query.update(conflicts_version=version, conflicts_progress=100)
+
+
+def queue_conflicts_recompute():
+    """
+    Mark schedule as changed and queue recompute_conflicts once transaction is committed,
+    unless it is already queued or running, then it will pick the change up by itself.
+    A dead run is replaced by a new one
+    """
+    from django.conf import settings
+    from django.db import transaction
+    from scheduler.conflicts_checker import bump_schedule_version
+    from scheduler.models import ScheduleState
+    with transaction.atomic():
+        state = bump_schedule_version(conflicts_updated=False)
+        if state.conflicts_status == ScheduleState.QUEUED or recompute_running(state):
+            return
+        state.conflicts_status = ScheduleState.QUEUED
+        state.conflicts_progress = 0
+        state.save()
+        transaction.on_commit(lambda: recompute_conflicts.apply_async(
+            countdown=getattr(settings, 'CONFLICTS_RECOMPUTE_DELAY', 0)))
+
+
+def refresh_queued_conflicts(state):
+    """
+    Queue recompute_conflicts without waiting for quiet period, called when conflicts are read.
+    Nothing is recomputed in the request, the task is queued once per version of schedule
+    :param state: ScheduleState read by the request
+    """
+    from django.conf import settings
+    from django.core.cache import cache
+    from scheduler.models import ScheduleState
+    if state.conflicts_status == ScheduleState.QUEUED \
+            and cache.add('conflicts_refresh:{}'.format(state.version), True,
+                          getattr(settings, 'CONFLICTS_RUNNING_TIMEOUT', DEFAULT_RUNNING_TIMEOUT)):
+        recompute_conflicts.apply_async(kwargs={'debounce': False})
+
+
+@app.task(name="import_file", bind=True, max_retries=3, default_retry_delay=30)
+def import_file(self, job_id):
+    """
+    Import uploaded file of ImportJob chunk by chunk
+    Retried when database is unavailable, every retry resumes after the last committed chunk
+    """
+    from django.db import OperationalError
+    from scheduler.import_jobs import run_import_job
+    try:
+        run_import_job(job_id, lessons_added=queue_conflicts_recompute)
+    except OperationalError as error:
+        raise self.retry(exc=error)
+
+
+def queue_import_file(job_id):
+    """Queue import_file once transaction is committed"""
+    from django.db import transaction
+    transaction.on_commit(lambda: import_file.apply_async(args=[job_id]))
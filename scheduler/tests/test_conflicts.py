@@ -1,11 +1,22 @@
 """Tests module for testing logic of finding conflicts"""
 
 import datetime
+from unittest import mock
 
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 
-from scheduler.models import Lesson, Professor, Group, Room, Conflict
-from scheduler.conflicts_checker import db_conflicts
+from scheduler.models import Lesson, Professor, Group, Room, Conflict, ScheduleState
+from scheduler.conflicts_checker import db_conflicts, find_conflicts, are_overlapping, \
+    update_conflicts_for, conflict_key, conflicts_diff, CONFLICTS_ENGINES, find_conflicts_array, \
+    python_db_conflicts, forecast_conflicts, process_pool
+from scheduler.calendar_util import generate_conflicts_context
+from scheduler.task import queue_conflicts_recompute, recompute_conflicts
 
 
 class NoConflictsTestCase(TestCase):
@@ -183,3 +194,433 @@ class CorrectnessOfAmountOfIncorrectDataListedTestCase(TestCase):
                                                      object_id=self.professor.id))
                          ,
                          1)
+
+
+class FindConflictsTestCase(TestCase):
+    """Class testing the sweep over lessons sharing professor, room or group"""
+    def setUp(self):
+        professors = [Professor.objects.create(name="John", surname=str(i)) for i in range(3)]
+        rooms = [Room.objects.create(number=str(i)) for i in range(3)]
+        groups = [Group.objects.create(name=str(i)) for i in range(3)]
+        start = datetime.datetime(2019, 5, 11, 8, 00)
+        for i in range(40):
+            lesson_start = start + datetime.timedelta(minutes=(i * 37) % 600)
+            Lesson.objects.create(
+                name="Lesson" + str(i),
+                professor=professors[i % 3],
+                room=rooms[(i // 3) % 3],
+                group=groups[(i * 7) % 3],
+                start_time=lesson_start,
+                end_time=lesson_start + datetime.timedelta(minutes=30 + (i * 13) % 90)
+            )
+
+    def test_same_conflicts_as_pairwise_check(self):
+        """Test if every overlapping pair of lessons is found exactly once"""
+        lessons = list(Lesson.objects.order_by('id'))
+        expected = set()
+        for index, lesson in enumerate(lessons):
+            for lesson_2 in lessons[index + 1:]:
+                if are_overlapping(lesson, lesson_2):
+                    for c_type, field in (("PROFESSOR", "professor_id"), ("ROOM", "room_id"),
+                                          ("GROUP", "group_id")):
+                        if getattr(lesson, field) == getattr(lesson_2, field):
+                            expected.add((c_type, lesson.id, lesson_2.id,
+                                          getattr(lesson, field)))
+        found = [(c_type, first.id, second.id, o_id)
+                 for c_type, first, second, o_id in find_conflicts(lessons)]
+        self.assertEqual(len(found), len(set(found)))
+        self.assertEqual(set(found), expected)
+        self.assertTrue(expected)
+
+    def test_columnar_same_as_sweep(self):
+        """Test if columnar search finds the same conflicts as the sweep"""
+        found = find_conflicts_array(Lesson.objects.values_list(
+            'id', 'start_time', 'end_time', 'professor_id', 'room_id', 'group_id'))
+        expected = [(c_type, first.id, second.id, o_id)
+                    for c_type, first, second, o_id in find_conflicts(Lesson.objects.all())]
+        self.assertEqual(sorted(found), sorted(expected))
+        self.assertEqual(find_conflicts_array([]), [])
+
+    def test_touching_lessons(self):
+        """Test if lesson starting when another ends is not a conflict"""
+        lessons = list(Lesson.objects.filter(room__number="0"))
+        lessons[1].start_time = lessons[0].end_time
+        lessons[1].end_time = lessons[0].end_time + datetime.timedelta(hours=1)
+        conflicts = find_conflicts(lessons[:2])
+        self.assertEqual(conflicts, [])
+
+
+class UpdateConflictsForTestCase(TestCase):
+    """Class testing refreshing conflicts of changed lessons only"""
+    def setUp(self):
+        self.professor = Professor.objects.create(name="John", surname="Doe")
+        self.room = Room.objects.create(number="1.11a")
+        self.first_lesson = Lesson.objects.create(
+            name="First lesson",
+            professor=self.professor,
+            room=self.room,
+            group=Group.objects.create(name="1"),
+            start_time=datetime.datetime(2019, 5, 11, 12, 00),
+            end_time=datetime.datetime(2019, 5, 11, 13, 30)
+        )
+        self.second_lesson = Lesson.objects.create(
+            name="Second lesson",
+            professor=Professor.objects.create(name="Adam", surname="Smith"),
+            room=self.room,
+            group=Group.objects.create(name="2"),
+            start_time=datetime.datetime(2019, 5, 11, 14, 00),
+            end_time=datetime.datetime(2019, 5, 11, 15, 00)
+        )
+        db_conflicts()
+
+    def test_moved_into_conflict(self):
+        """Test when edited lesson starts overlapping another"""
+        self.second_lesson.start_time = datetime.datetime(2019, 5, 11, 13, 00)
+        self.second_lesson.save()
+        update_conflicts_for([self.second_lesson.id])
+        self.assertEqual(list(Conflict.objects.values_list('conflict_type', 'first_lesson',
+                                                           'second_lesson', 'object_id')),
+                         [('ROOM', self.first_lesson.id, self.second_lesson.id, self.room.id)])
+
+    def test_moved_out_of_conflict(self):
+        """Test when edited lesson does not overlap another anymore"""
+        self.second_lesson.start_time = datetime.datetime(2019, 5, 11, 13, 00)
+        self.second_lesson.save()
+        db_conflicts()
+        self.second_lesson.start_time = datetime.datetime(2019, 5, 11, 14, 00)
+        self.second_lesson.save()
+        update_conflicts_for([str(self.second_lesson.id)])
+        self.assertQuerysetEqual(Conflict.objects.all(), Conflict.objects.none())
+
+    def test_same_result_as_rebuild(self):
+        """Test if refreshing changed lessons gives the same conflicts as full rebuild"""
+        lesson = Lesson.objects.create(
+            name="Third lesson",
+            professor=self.professor,
+            room=Room.objects.create(number="1.11b"),
+            group=Group.objects.get(name="2"),
+            start_time=datetime.datetime(2019, 5, 11, 13, 00),
+            end_time=datetime.datetime(2019, 5, 11, 14, 30)
+        )
+        update_conflicts_for([lesson.id])
+        incremental = set(Conflict.objects.values_list('conflict_type', 'first_lesson',
+                                                       'second_lesson', 'object_id'))
+        db_conflicts()
+        rebuilt = set(Conflict.objects.values_list('conflict_type', 'first_lesson',
+                                                   'second_lesson', 'object_id'))
+        self.assertEqual(incremental, rebuilt)
+        self.assertEqual(len(rebuilt), 2)
+
+
+class ForecastConflictsTestCase(TestCase):
+    """Class testing conflicts check of proposed lessons, which writes nothing"""
+    def setUp(self):
+        self.professor = Professor.objects.create(name="John", surname="Doe")
+        self.room = Room.objects.create(number="1.11a")
+        self.first_lesson = Lesson.objects.create(
+            name="First lesson",
+            professor=self.professor,
+            room=self.room,
+            group=Group.objects.create(name="1"),
+            start_time=datetime.datetime(2019, 5, 11, 12, 00),
+            end_time=datetime.datetime(2019, 5, 11, 13, 30)
+        )
+        self.second_lesson = Lesson.objects.create(
+            name="Second lesson",
+            professor=Professor.objects.create(name="Adam", surname="Smith"),
+            room=self.room,
+            group=Group.objects.create(name="2"),
+            start_time=datetime.datetime(2019, 5, 11, 14, 00),
+            end_time=datetime.datetime(2019, 5, 11, 15, 00)
+        )
+
+    def test_new_lesson(self):
+        """Test unsaved lesson sharing professor and room with existing one"""
+        lesson = Lesson(name="New lesson", professor=self.professor, room=self.room,
+                        group=Group.objects.create(name="3"),
+                        start_time=datetime.datetime(2019, 5, 11, 13, 00),
+                        end_time=datetime.datetime(2019, 5, 11, 14, 00))
+        conflicts = forecast_conflicts([lesson])
+        self.assertEqual({(c_type, first.name, second.id, o_id)
+                          for c_type, first, second, o_id in conflicts},
+                         {("PROFESSOR", "New lesson", self.first_lesson.id, self.professor.id),
+                          ("ROOM", "New lesson", self.first_lesson.id, self.room.id)})
+        self.assertEqual(Lesson.objects.count(), 2)
+        self.assertEqual(Conflict.objects.count(), 0)
+
+    def test_edited_lesson(self):
+        """Test lesson moved in time is not checked against its saved version"""
+        self.second_lesson.start_time = datetime.datetime(2019, 5, 11, 13, 00)
+        conflicts = forecast_conflicts([self.second_lesson])
+        self.assertEqual([(c_type, second.id) for c_type, _first, second, _o_id in conflicts],
+                         [("ROOM", self.first_lesson.id)])
+        self.assertEqual(Lesson.objects.get(id=self.second_lesson.id).start_time,
+                         datetime.datetime(2019, 5, 11, 14, 00))
+
+    def test_new_resources(self):
+        """Test resources which don't exist yet can't be in conflict"""
+        lesson = Lesson(name="New lesson", start_time=datetime.datetime(2019, 5, 11, 12, 00),
+                        end_time=datetime.datetime(2019, 5, 11, 13, 00))
+        self.assertEqual(forecast_conflicts([lesson, lesson]), [])
+
+    def test_check_conflicts_view(self):
+        """Test endpoint checking lesson from edit form"""
+        self.client.force_login(get_user_model().objects.create_user("planner"))
+        response = self.client.post(reverse('check_conflicts'), {
+            'id': self.second_lesson.id, 'name': "Second lesson", 'professor': "Adam Smith",
+            'room': "1.11a", 'group': "2",
+            'start_time_0': "2019-05-11", 'start_time_1': "13:00",
+            'end_time_0': "2019-05-11", 'end_time_1': "15:00"})
+        conflicts = response.json()['conflicts']
+        self.assertEqual([(conflict['type'], conflict['object'], conflict['other']['id'])
+                          for conflict in conflicts],
+                         [("ROOM", "1.11a", self.first_lesson.id)])
+        self.assertEqual(Conflict.objects.count(), 0)
+
+
+class SaveConflictsTestCase(TestCase):
+    """Class testing batched persistence of conflicts"""
+    def setUp(self):
+        professor = Professor.objects.create(name="John", surname="Doe")
+        room = Room.objects.create(number="1.11a")
+        group = Group.objects.create(name="1")
+        for i in range(8):
+            Lesson.objects.create(
+                name="Lesson" + str(i),
+                professor=professor,
+                room=room,
+                group=group,
+                start_time=datetime.datetime(2019, 5, 11, 12, i),
+                end_time=datetime.datetime(2019, 5, 11, 13, 30)
+            )
+
+    @override_settings(CONFLICTS_BATCH_SIZE=5)
+    def test_rebuild_in_batches(self):
+        """Test if conflicts are inserted in batches within one transaction"""
+        with CaptureQueriesContext(connection) as queries:
+            db_conflicts()
+        inserts = [query for query in queries.captured_queries
+                   if query['sql'].startswith('INSERT INTO "scheduler_conflict"')]
+        self.assertEqual(len(inserts), 17)
+        self.assertEqual(Conflict.objects.count(), 3 * 28)
+
+    def test_failed_rebuild_keeps_old_conflicts(self):
+        """Test if conflicts stay untouched when the rebuild fails"""
+        db_conflicts()
+        with mock.patch('scheduler.conflicts_checker.save_conflicts',
+                        side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                db_conflicts()
+        self.assertEqual(Conflict.objects.count(), 3 * 28)
+
+
+class ConflictsDiffTestCase(TestCase):
+    """Class testing comparing conflicts before and after change"""
+    def setUp(self):
+        self.professor = Professor.objects.create(name="John", surname="Doe")
+        self.first_lesson = Lesson.objects.create(
+            name="First lesson",
+            professor=self.professor,
+            room=Room.objects.create(number="1.11a"),
+            group=Group.objects.create(name="1"),
+            start_time=datetime.datetime(2019, 5, 11, 12, 00),
+            end_time=datetime.datetime(2019, 5, 11, 13, 30)
+        )
+        self.second_lesson = Lesson.objects.create(
+            name="Second lesson",
+            professor=self.professor,
+            room=Room.objects.create(number="1.11b"),
+            group=Group.objects.create(name="2"),
+            start_time=datetime.datetime(2019, 5, 11, 13, 00),
+            end_time=datetime.datetime(2019, 5, 11, 15, 00)
+        )
+
+    def test_key_ignores_lessons_order(self):
+        """Test if conflict has the same key when its lessons are swapped"""
+        conflict = Conflict(conflict_type='PROFESSOR', object_id=self.professor.id,
+                            first_lesson=self.first_lesson, second_lesson=self.second_lesson)
+        swapped = Conflict(conflict_type='PROFESSOR', object_id=self.professor.id,
+                           first_lesson=self.second_lesson, second_lesson=self.first_lesson)
+        self.assertEqual(conflict_key(conflict), conflict_key(swapped))
+
+    def test_diff(self):
+        """Test if new and removed conflicts are found without loading lessons"""
+        db_conflicts()
+        past_conflicts = list(Conflict.objects.all())
+        self.second_lesson.room = self.first_lesson.room
+        self.second_lesson.save()
+        update_conflicts_for([self.second_lesson.id])
+        current_conflicts = list(Conflict.objects.all())
+        with self.assertNumQueries(0):
+            new_conflicts, removed_conflicts = conflicts_diff(past_conflicts, current_conflicts)
+        self.assertEqual([conflict.conflict_type for conflict in new_conflicts], ['ROOM'])
+        self.assertEqual(removed_conflicts, [])
+        self.second_lesson.room = Room.objects.get(number="1.11b")
+        self.second_lesson.save()
+        update_conflicts_for([self.second_lesson.id])
+        reverted_conflicts = list(Conflict.objects.all())
+        with self.assertNumQueries(0):
+            new_conflicts, removed_conflicts = conflicts_diff(current_conflicts,
+                                                              reverted_conflicts)
+        self.assertEqual(new_conflicts, [])
+        self.assertEqual([conflict.conflict_type for conflict in removed_conflicts], ['ROOM'])
+
+
+class ConflictsEnginesTestCase(TestCase):
+    """Class testing if every engine finds the same conflicts"""
+    def setUp(self):
+        professors = [Professor.objects.create(name="John", surname=str(i)) for i in range(4)]
+        rooms = [Room.objects.create(number=str(i)) for i in range(5)]
+        groups = [Group.objects.create(name=str(i)) for i in range(3)]
+        start = datetime.datetime(2019, 5, 11, 8, 00)
+        for i in range(60):
+            lesson_start = start + datetime.timedelta(minutes=(i * 53) % 900)
+            Lesson.objects.create(
+                name="Lesson" + str(i),
+                professor=professors[i % 4],
+                room=rooms[(i // 2) % 5],
+                group=groups[(i * 7) % 3],
+                start_time=lesson_start,
+                end_time=lesson_start + datetime.timedelta(minutes=(i * 29) % 120)
+            )
+        lesson = Lesson.objects.get(name="Lesson1")
+        Lesson.objects.create(
+            name="Zero duration",
+            professor=lesson.professor,
+            room=rooms[4],
+            group=groups[2],
+            start_time=lesson.end_time,
+            end_time=lesson.end_time
+        )
+        lesson = Lesson.objects.get(name="Lesson2")
+        Lesson.objects.create(
+            name="Same start",
+            professor=lesson.professor,
+            room=rooms[4],
+            group=groups[2],
+            start_time=lesson.start_time,
+            end_time=lesson.end_time + datetime.timedelta(minutes=10)
+        )
+
+    def test_engines(self):
+        """Test if engines give the same conflicts as python engine, edge cases included"""
+        db_conflicts()
+        expected = set(Conflict.objects.values_list('conflict_type', 'first_lesson',
+                                                    'second_lesson', 'object_id'))
+        self.assertTrue(expected)
+        for engine in CONFLICTS_ENGINES:
+            with self.subTest(engine=engine), override_settings(CONFLICTS_ENGINE=engine):
+                db_conflicts()
+                found = list(Conflict.objects.values_list('conflict_type', 'first_lesson',
+                                                          'second_lesson', 'object_id'))
+                self.assertEqual(len(found), len(expected))
+                self.assertEqual(set(found), expected)
+
+    def test_process_pool_python_36(self):
+        """Pool of parallel engine works without initializer, missing before Python 3.7"""
+        with mock.patch('scheduler.conflicts_checker.sys', version_info=(3, 6, 9)), \
+                mock.patch('scheduler.conflicts_checker.ProcessPoolExecutor') as pool:
+            process_pool(2)
+        pool.assert_called_once_with(max_workers=2)
+
+
+@override_settings(CONFLICTS_RECOMPUTE_DELAY=0)
+class RecomputeConflictsTaskTestCase(TestCase):
+    """Class testing recomputing conflicts in background, without waiting for quiet period"""
+    def setUp(self):
+        professor = Professor.objects.create(name="John", surname="Doe")
+        for i in range(2):
+            Lesson.objects.create(
+                name="Lesson" + str(i),
+                professor=professor,
+                room=Room.objects.create(number=str(i)),
+                group=Group.objects.create(name=str(i)),
+                start_time=datetime.datetime(2019, 5, 11, 12, 00),
+                end_time=datetime.datetime(2019, 5, 11, 13, 30)
+            )
+
+    def test_requests_are_coalesced(self):
+        """Test if requests made before the task started are handled by one run"""
+        queue_conflicts_recompute()
+        queue_conflicts_recompute()
+        state = ScheduleState.load()
+        self.assertEqual(state.conflicts_status, ScheduleState.QUEUED)
+        self.assertEqual(state.version, 2)
+        with mock.patch('scheduler.conflicts_checker.CONFLICTS_ENGINES',
+                        {'python': mock.Mock(side_effect=python_db_conflicts)}) as engines:
+            recompute_conflicts()
+            self.assertEqual(engines['python'].call_count, 1)
+        state = ScheduleState.load()
+        self.assertEqual(state.conflicts_status, ScheduleState.IDLE)
+        self.assertEqual(state.conflicts_version, 2)
+        self.assertEqual(Conflict.objects.count(), 1)
+
+    def test_change_while_running(self):
+        """Test if schedule changed during a run causes one follow-up run"""
+        queue_conflicts_recompute()
+
+        def change_schedule(progress):
+            python_db_conflicts(progress)
+            if engine.call_count == 1:
+                queue_conflicts_recompute()
+                self.assertEqual(ScheduleState.load().conflicts_status, ScheduleState.RUNNING)
+        engine = mock.Mock(side_effect=change_schedule)
+        with mock.patch('scheduler.conflicts_checker.CONFLICTS_ENGINES', {'python': engine}):
+            recompute_conflicts()
+        self.assertEqual(engine.call_count, 2)
+        state = ScheduleState.load()
+        self.assertEqual((state.version, state.conflicts_version), (2, 2))
+
+    def test_running_is_not_duplicated(self):
+        """Test if run which reports progress is left alone"""
+        ScheduleState.objects.update_or_create(pk=1, defaults={
+            'version': 1, 'conflicts_status': ScheduleState.RUNNING,
+            'conflicts_heartbeat': timezone.now()})
+        queue_conflicts_recompute()
+        self.assertEqual(ScheduleState.load().conflicts_status, ScheduleState.RUNNING)
+        with mock.patch('scheduler.conflicts_checker.CONFLICTS_ENGINES',
+                        {'python': mock.Mock()}) as engines:
+            recompute_conflicts(debounce=False)
+        engines['python'].assert_not_called()
+
+    def test_dead_run_is_replaced(self):
+        """Test if run of a worker which died is queued and run again"""
+        ScheduleState.objects.update_or_create(pk=1, defaults={
+            'version': 1, 'conflicts_status': ScheduleState.RUNNING,
+            'conflicts_heartbeat': timezone.now() - datetime.timedelta(hours=1)})
+        with override_settings(CONFLICTS_RUNNING_TIMEOUT=60):
+            queue_conflicts_recompute()
+            self.assertEqual(ScheduleState.load().conflicts_status, ScheduleState.QUEUED)
+            recompute_conflicts(debounce=False)
+        state = ScheduleState.load()
+        self.assertEqual((state.conflicts_status, state.conflicts_version),
+                         (ScheduleState.IDLE, 2))
+        self.assertEqual(Conflict.objects.count(), 1)
+
+    @override_settings(CONFLICTS_RECOMPUTE_DELAY=60)
+    def test_waits_for_quiet_period(self):
+        """Test if task waits until schedule stops changing, unless conflicts are read"""
+        cache.clear()
+        queue_conflicts_recompute()
+        recompute_conflicts()
+        state = ScheduleState.load()
+        self.assertEqual(state.conflicts_status, ScheduleState.QUEUED)
+        self.assertEqual(state.conflicts_version, 0)
+        self.assertEqual(Conflict.objects.count(), 0)
+        with mock.patch('scheduler.task.recompute_conflicts.apply_async') as apply_async:
+            context = generate_conflicts_context()
+            generate_conflicts_context()
+        apply_async.assert_called_once_with(kwargs={'debounce': False})
+        self.assertTrue(context['conflicts_recomputing'])
+        self.assertEqual(len(context['conflicts']), 0)
+        recompute_conflicts(debounce=False)
+        context = generate_conflicts_context()
+        self.assertFalse(context['conflicts_recomputing'])
+        self.assertEqual(len(context['conflicts']), 1)
+
+    def test_incremental_update_keeps_conflicts_current(self):
+        """Test if conflicts updated for edited lesson stay up to date"""
+        lesson = Lesson.objects.get(name="Lesson1")
+        update_conflicts_for([lesson.id])
+        state = ScheduleState.load()
+        self.assertEqual((state.version, state.conflicts_version), (1, 1))
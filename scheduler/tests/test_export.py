@@ -0,0 +1,64 @@
+"""Tests of schedule export"""
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.http import StreamingHttpResponse
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from scheduler.export_handlers import export_to_csv, get_lessons
+from scheduler.models import Lesson, Professor, Room, Group
+
+
+class ExportTest(TestCase):
+    """Class testing export of lessons from given period"""
+
+    @classmethod
+    def setUpTestData(cls):
+        professor = Professor.objects.create(name="John", surname="Doe")
+        room = Room.objects.create(number="1.11a")
+        group = Group.objects.create(name="1")
+        for day, name in ((11, "First"), (12, "Second, with comma"), (20, "Outside")):
+            Lesson.objects.create(name=name, professor=professor, room=room, group=group,
+                                  start_time=datetime.datetime(2019, 5, day, 12, 00),
+                                  end_time=datetime.datetime(2019, 5, day, 13, 30))
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_user("planner"))
+
+    def test_export_to_csv(self):
+        """Lessons are streamed line by line, read in chunks of EXPORT_CHUNK_SIZE"""
+        with override_settings(EXPORT_CHUNK_SIZE=1):
+            lines = list(export_to_csv(datetime.datetime(2019, 5, 10),
+                                       datetime.datetime(2019, 5, 13)))
+        self.assertEqual(lines, ["Date,Start time,End time,Lesson,Professor,Group,Room\n",
+                                 "11-05-19,12:00,13:30,First,John Doe,1,1.11a\n",
+                                 '12-05-19,12:00,13:30,"Second, with comma",John Doe,1,1.11a\n'])
+
+    def test_get_lessons(self):
+        """Lessons are read with one query, whatever their number, in csv or excel layout"""
+        with self.assertNumQueries(1):
+            data = get_lessons(datetime.datetime(2019, 5, 10), datetime.datetime(2019, 5, 13),
+                               False)
+        self.assertEqual(data.values.tolist(),
+                         [["2019-05-11", "12:00:00", "13:30:00", "First", "John Doe", "1",
+                           "1.11a"],
+                          ["2019-05-12", "12:00:00", "13:30:00", "Second, with comma",
+                           "John Doe", "1", "1.11a"]])
+        self.assertEqual(get_lessons(datetime.datetime(2019, 5, 19),
+                                     datetime.datetime(2019, 5, 21), True).values.tolist(),
+                         [["20-05-19", "12:00", "13:30", "Outside", "John Doe", "1", "1.11a"]])
+        self.assertTrue(get_lessons(datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 2),
+                                    True).empty)
+
+    def test_export_view_streams_csv(self):
+        """Csv export is sent as streaming response, no file is written"""
+        response = self.client.post(reverse('export'), {
+            'start_time_0': '2019-05-10', 'start_time_1': '00:00',
+            'end_time_0': '2019-05-13', 'end_time_1': '00:00', 'file_format': 'csv'},
+                                    HTTP_REFERER='/calendar/')
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename=schedule.csv')
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn("First", content)
+        self.assertNotIn("Outside", content)
@@ -1,13 +1,28 @@
 """First tests module"""
 import datetime
+import io
+import zipfile
+from unittest import mock
 
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
 import pandas as pd
 
-from scheduler.import_handlers import parse_data, import_csv, import_excel, ImportSizeException, \
-    ImportExtensionException
-from scheduler.models import Lesson, Professor, Room, Group
+from scheduler.import_handlers import parse_data, import_csv, import_excel, parse_csv, \
+    import_students, read_xlsx_chunks, forecast_import, import_batch, ImportSizeException, \
+    ImportExtensionException, ImportCorruptedException
+from scheduler.conflicts_checker import update_conflicts_for
+from scheduler.models import Lesson, Professor, Room, Group, Student
+
+SCHEDULE_CSV = (b"Date,Start_time,End_time,Subject,Professor,Grupa,Auditorium\n"
+                b"11-05-19,12:00,13:30,First,John Doe,1,1.11a\n"
+                b"12-05-19,14:00,15:30,IncorrectName,John,3,2.41\n"
+                b"31-05-19,20:00,22:00,Second,John Doe,2,2.41\n")
 
 
 class ImportHandlersTest(TestCase):
@@ -118,3 +133,271 @@ class ImportHandlersTest(TestCase):
         self.assertEqual(Lesson.objects.filter(name="IncorrectDateType").count(), 0)
         self.assertEqual(Lesson.objects.filter(name="IncorrectTimeType").count(), 0)
         self.assertEqual(Lesson.objects.filter(name="IncorrectProfessorType").count(), 0)
+
+    def test_import_queries(self):
+        """Number of queries does not grow with number of rows"""
+        data = pd.DataFrame([["11-05-19", "{:02d}:00".format(hour), "{:02d}:45".format(hour),
+                              "Lesson", "Adam Smith", str(number), "1.{}".format(number)]
+                             for number in range(50) for hour in range(8, 20)])
+        with CaptureQueriesContext(connection) as queries:
+            added, incorrect, duplicate = import_csv(data)
+        self.assertEqual((added, incorrect, duplicate), (600, [], []))
+        self.assertLess(len(queries), 20)
+        self.assertEqual(import_csv(data), (0, [], list(range(600))))
+
+    def test_parse_csv(self):
+        """Every row is checked on its own, even though columns are parsed at once"""
+        data = pd.DataFrame(
+            [["31-02-19", "12:00", "13:30", "NoSuchDay", "John Doe", "1", "1.11a"],
+             ["2019-05-10", "24:00", "13:30", "NoSuchHour", "John Doe", "1", "1.11a"],
+             ["10-05-19", "8:05:00", "9:40", " Seconds ", " John  Doe ", 1, 2.41],
+             ["10-05-19", "8:05", "9:40", "Seconds", "John Doe", None, 2.41],
+             ["11-5-2019", "12:00", "13:30", "LongYear", "John Doe", "1", "1.11a"]])
+        records, incorrect = parse_csv(data)
+        # DD-MM-YYYY was saved as year 4019 by row by row import, now it is incorrect
+        self.assertEqual(incorrect, [0, 1, 3, 4])
+        self.assertEqual(records, [(2, "Seconds", ("John", "Doe"), "1", "2.41",
+                                    datetime.datetime(2019, 5, 10, 8, 5),
+                                    datetime.datetime(2019, 5, 10, 9, 40))])
+
+    def test_read_xlsx_chunks(self):
+        """Streamed chunks have the same rows and types as the whole sheet read by pandas"""
+        data = pd.DataFrame(
+            [[pd.Timestamp(2019, 5, 11), datetime.time(12, 00), datetime.time(13, 30),
+              "Existing", "John Doe", 1, "1.11a"],
+             [pd.Timestamp(2019, 5, 12), datetime.time(14, 00), datetime.time(15, 30),
+              "NoRoom", "John Doe", "3", None],
+             [None] * 7,
+             ["2019-05-10", "13:00", "14:00", "Correct", "Adam Smith", "1", 132]],
+            columns=['Date', 'Start', 'End', 'Lesson', 'Professor', 'Group', 'Room'], dtype=object)
+        file = io.BytesIO()
+        data.to_excel(file, index=False)
+        chunks = list(read_xlsx_chunks(file, chunk_size=2))
+        self.assertEqual([chunk.index.tolist() for chunk in chunks], [[0, 1], [2]])
+        self.assertEqual(list(chunks[0].columns), list(data.columns))
+        self.assertEqual(import_excel(pd.concat(chunks)), (1, [1], [0]))
+        resumed = list(read_xlsx_chunks(file, chunk_size=2, start_row=1))
+        self.assertEqual([chunk.index.tolist() for chunk in resumed], [[1, 2]])
+        with self.assertRaises(ImportCorruptedException):
+            list(read_xlsx_chunks(io.BytesIO(b"not a workbook"), chunk_size=2))
+
+    def test_import_row_hashes(self):
+        """Rows imported before are found by their hash, saving a lesson keeps it"""
+        data = pd.DataFrame([["31-05-19", "20:00", "22:00", "Correct", "John Doe", "2", "2.41"],
+                             ["31-05-19", "08:00", "09:30", "Other", "John Doe", "2", "2.41"]])
+        self.assertEqual(import_csv(data), (2, [], []))
+        self.assertEqual(Lesson.objects.exclude(source_hash='').count(), 2)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(import_csv(data), (0, [], [0, 1]))
+        self.assertFalse(any('professor' in query['sql'] for query in queries.captured_queries))
+        lesson = Lesson.objects.get(name="Other")
+        source_hash = lesson.source_hash
+        lesson.save()
+        self.assertEqual(Lesson.objects.get(name="Other").source_hash, source_hash)
+        self.assertEqual(Lesson.objects.create(
+            name="Created", professor=lesson.professor, room=lesson.room, group=lesson.group,
+            start_time=lesson.start_time, end_time=lesson.end_time,
+            source_hash="0" * 32).source_hash, "0" * 32)
+
+    def test_import_dry_run(self):
+        """Dry run writes nothing and reports what the import would do"""
+        data = pd.DataFrame([["11-05-19", "12:00", "13:30", "Existing", "John Doe", "1", "1.11a"],
+                             ["12-05-19", "14:00", "15:30", "IncorrectName", "John", "3", "2.41"],
+                             ["31-05-19", "20:00", "22:00", "New", "Jane Roe", "2", "2.41"],
+                             ["31-05-19", "20:00", "22:00", "New", "Jane Roe", "2", "2.41"]])
+        counts = (Lesson.objects.count(), Professor.objects.count(), Room.objects.count(),
+                  Group.objects.count())
+        self.assertEqual(parse_data(data, ".csv", dry_run=True), (1, [1], [0, 3]))
+        self.assertEqual((Lesson.objects.count(), Professor.objects.count(),
+                          Room.objects.count(), Group.objects.count()), counts)
+        self.assertEqual(parse_data(data, ".csv"), (1, [1], [0, 3]))
+
+    def test_forecast_import(self):
+        """Conflicts with lessons in database and between new rows are forecast"""
+        data = pd.DataFrame([["11-05-19", "13:00", "14:00", "Overlaps", "Jane Roe", "7", "1.11a"],
+                             ["11-05-19", "08:00", "09:00", "Free", "Jane Roe", "7", "3.01"],
+                             ["11-05-19", "08:30", "09:30", "Busy", "Jane Roe", "8", "3.02"],
+                             ["12-05-19", "14:00", "15:30", "IncorrectName", "John", "3", "2.41"]])
+        added, incorrect, duplicate, conflicts = forecast_import(data, ".csv")
+        self.assertEqual((added, incorrect, duplicate), (3, [3], []))
+        self.assertEqual([(c_type, row) for c_type, row, _other in conflicts],
+                         [("ROOM", 0), ("PROFESSOR", 1)])
+        self.assertEqual(conflicts[0][2].name, "Existing")
+        self.assertEqual(conflicts[1][2], 2)
+        self.assertEqual(Lesson.objects.count(), 1)
+        self.assertFalse(Professor.objects.filter(surname="Roe").exists())
+
+    def test_import_batch(self):
+        """Files are parsed in worker processes and saved together, broken file is reported"""
+        other = (b"Date,Start_time,End_time,Subject,Professor,Grupa,Auditorium\n"
+                 b"31-05-19,20:00,22:00,Second,John Doe,2,2.41\n"
+                 b"01-06-19,08:00,09:30,Third,John Doe,2,2.41\n")
+        files = [("first.csv", SCHEDULE_CSV), ("second.csv", other), ("notes.txt", b"text")]
+        with override_settings(IMPORT_WORKERS=2):
+            results = import_batch(files)
+        self.assertEqual([result[:5] for result in results],
+                         [("first.csv", 3, 2, [1], []), ("second.csv", 2, 1, [], [0]),
+                          ("notes.txt", 0, 0, [], [])])
+        self.assertEqual([result[5] for result in results[:2]], [None, None])
+        self.assertIsInstance(results[2][5], ImportExtensionException)
+        self.assertEqual(Lesson.objects.count(), 4)
+
+    def test_import_students(self):
+        """
+        Students are keyed on index number, the same student is a duplicate,
+        a changed one is updated, incorrect are not added at all
+        """
+        Student.objects.create(name="Adam", surname="Smith", index=234567,
+                               group=Group.objects.get(name="1"))
+        Student.objects.create(name="Eve", surname="Moved", index=345678,
+                               group=Group.objects.get(name="1"))
+        Student.objects.create(name="Jon", surname="Typo", index=456780,
+                               group=Group.objects.get(name="1"))
+        data = pd.DataFrame(
+            [["123456", "John Doe", "1"],
+             [234567, "Adam Smith", 1],
+             [" 345678 ", "Eve Moved", "2"],
+             ["12345", "ShortIndex Student", "1"],
+             ["1234567", "LongIndex Student", "1"],
+             ["12345a", "Letter Student", "1"],
+             ["456789", "Name", "1"],
+             ["456789", "Too Many Names", "1"],
+             ["567890", "No Group", None],
+             [123456, "John Doe", "1"],
+             ["678901", "Jane Roe", 2],
+             ["456780", "Jon Fixed", "1"]])
+        with CaptureQueriesContext(connection) as queries:
+            added, incorrect, duplicate = import_students(data)
+        self.assertLess(len(queries), 10)
+        self.assertEqual(added, 4)
+        self.assertEqual(incorrect, [3, 4, 5, 6, 7, 8])
+        self.assertEqual(duplicate, [1, 9])
+        self.assertEqual(Student.objects.count(), 5)
+        self.assertEqual(Student.objects.get(index=345678).group.name, "2")
+        self.assertEqual(Student.objects.get(index=456780).surname, "Fixed")
+        self.assertEqual(Student.objects.get(index=678901).surname, "Roe")
+        self.assertEqual(import_students(data), (0, [3, 4, 5, 6, 7, 8], [0, 1, 2, 9, 10, 11]))
+
+    def test_import_students_dry_run(self):
+        """Dry run of students import counts new and changed students, saves none of them"""
+        Student.objects.create(name="Adam", surname="Smith", index=234567,
+                               group=Group.objects.get(name="1"))
+        data = pd.DataFrame([["123456", "John Doe", "9"],
+                             ["234567", "Adam Smith", "1"],
+                             ["234567", "Adam Smith", "1"],
+                             ["12", "Short Index", "1"]])
+        self.assertEqual(import_students(data, dry_run=True), (1, [3], [1, 2]))
+        self.assertEqual(Student.objects.count(), 1)
+        self.assertFalse(Group.objects.filter(name="9").exists())
+
+
+class UploadViewTest(TestCase):
+    """Class testing upload views parsing files straight from the upload"""
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_user("planner"))
+
+    def upload(self, name, content, **fields):
+        """Posts file to schedule upload page"""
+        return self.client.post(reverse('upload_schedule'),
+                                {'uploaded_file': SimpleUploadedFile(name, content), **fields})
+
+    def test_upload_from_memory(self):
+        """Small upload is parsed from memory and nothing is saved to storage"""
+        with mock.patch('django.core.files.storage.default_storage.save') as save:
+            response = self.upload("schedule.csv", SCHEDULE_CSV)
+        save.assert_not_called()
+        self.assertEqual(response.context['added'], 2)
+        self.assertEqual(Lesson.objects.count(), 2)
+
+    def test_upload_from_temporary_file(self):
+        """Big upload is parsed from the temporary file Django keeps it in"""
+        with override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0):
+            response = self.upload("schedule.csv", SCHEDULE_CSV)
+        self.assertEqual(response.context['added'], 2)
+
+    def test_upload_extension(self):
+        """Unsupported extension is reported"""
+        response = self.upload("schedule.txt", SCHEDULE_CSV)
+        self.assertEqual(response.context['error'], "Error: Extension not supported")
+
+    def test_edited_lesson_loses_hash(self):
+        """Lesson edited in the calendar no longer matches its row and is imported again"""
+        self.upload("schedule.csv", SCHEDULE_CSV)
+        lesson = Lesson.objects.get(name="Second")
+        self.client.post(reverse('edit', args=[lesson.id]), {
+            'id': lesson.id, 'name': "Second", 'professor': "John Doe", 'room': "2.41",
+            'group': "2", 'start_time_0': '2019-05-31', 'start_time_1': '20:00',
+            'end_time_0': '2019-05-31', 'end_time_1': '21:00'}, HTTP_REFERER='/calendar/')
+        self.assertEqual(Lesson.objects.get(id=lesson.id).source_hash, '')
+        self.assertEqual(self.upload("schedule.csv", SCHEDULE_CSV).context['added'], 1)
+
+    def test_upload_preview(self):
+        """Bigger file shows only its incorrect and duplicate rows"""
+        with override_settings(IMPORT_PREVIEW_ROWS=1):
+            response = self.upload("schedule.csv", SCHEDULE_CSV)
+        self.assertTrue(response.context['errors_only'])
+        self.assertEqual((response.context['rows_count'], response.context['incorrect_count'],
+                          response.context['shown_count']), (3, 1, 1))
+        self.assertContains(response, "IncorrectName")
+        self.assertNotContains(response, "Second")
+        self.assertContains(response, "background: lightcoral")
+
+    def test_upload_identical_file(self):
+        """Identical file is not imported again until schedule changes"""
+        self.upload("schedule.csv", SCHEDULE_CSV)
+        with mock.patch('scheduler.import_handlers.parse_data') as parse:
+            response = self.upload("again.csv", SCHEDULE_CSV)
+        parse.assert_not_called()
+        self.assertEqual(response.context['identical'].original_name, "schedule.csv")
+        self.assertEqual((response.context['added'], response.context['incorrect_count'],
+                          response.context['duplicate_count']), (0, 1, 2))
+        lesson = Lesson.objects.get(name="First")
+        lesson.name = "Edited"
+        lesson.source_hash = ''
+        lesson.save()
+        update_conflicts_for([lesson.id])
+        response = self.upload("again.csv", SCHEDULE_CSV)
+        self.assertNotIn('identical', response.context)
+        self.assertEqual(response.context['added'], 1)
+
+    def test_upload_dry_run(self):
+        """Checked file is not imported, not remembered and no conflicts are queued"""
+        with mock.patch('scheduler.views.queue_conflicts_recompute') as queue:
+            response = self.upload("schedule.csv", SCHEDULE_CSV, dry_run="1")
+        queue.assert_not_called()
+        self.assertTrue(response.context['dry_run'])
+        self.assertEqual((response.context['added'], response.context['incorrect_count']), (2, 1))
+        self.assertEqual(response.context['forecast_count'], 0)
+        self.assertContains(response, "nothing was saved")
+        self.assertEqual(Lesson.objects.count(), 0)
+        self.assertEqual(self.upload("schedule.csv", SCHEDULE_CSV).context['added'], 2)
+
+    def test_upload_zip(self):
+        """Files of zip archive, whatever the case of extension, are imported at once
+        and conflicts are queued once"""
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zipped:
+            zipped.writestr("schedule/first.csv", SCHEDULE_CSV)
+            zipped.writestr("schedule/readme.md", "not a schedule")
+            zipped.writestr("second.csv", SCHEDULE_CSV.replace(b"First", b"Third"))
+            zipped.writestr("THIRD.CSV", SCHEDULE_CSV.replace(b"First", b"Fourth"))
+        with mock.patch('scheduler.views.queue_conflicts_recompute') as queue:
+            response = self.upload("schedules.zip", archive.getvalue())
+        queue.assert_called_once_with()
+        self.assertEqual([(file['name'], file['added'], file['duplicate_count'])
+                          for file in response.context['batch']],
+                         [("schedule/first.csv", 2, 0), ("second.csv", 1, 1),
+                          ("THIRD.CSV", 1, 1)])
+        self.assertEqual(Lesson.objects.count(), 4)
+
+    def test_upload_several_files(self):
+        """File imported before is skipped in batch upload"""
+        self.upload("first.csv", SCHEDULE_CSV)
+        response = self.client.post(reverse('upload_schedule'), {'uploaded_file': [
+            SimpleUploadedFile("again.csv", SCHEDULE_CSV),
+            SimpleUploadedFile("broken.xlsx", b"not a workbook")]})
+        self.assertEqual([(file['added'], file['error']) for file in response.context['batch']],
+                         [(0, "Identical to first.csv imported before"),
+                          (0, "Corrupted file")])
+        self.assertContains(response, "broken.xlsx")
@@ -0,0 +1,156 @@
+"""Tests of background import jobs"""
+import datetime
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+import scheduler.import_handlers as imp
+from scheduler.import_jobs import run_import_job, reset_failed_job
+from scheduler.models import ImportJob, Lesson, Student
+
+SCHEDULE = ("Date,Start_time,End_time,Subject,Professor,Grupa,Auditorium\n"
+            "11-05-19,12:00,13:30,First,John Doe,1,1.11a\n"
+            "12-05-19,14:00,15:30,IncorrectName,John,3,2.41\n"
+            "10-05-19,13:00,14:00,Duplicate,Adam Smith,1,132\n"
+            "31-05-19,20:00,22:00,Second,John Doe,2,2.41\n"
+            "10-05-19,13:00,14:00,Duplicate,Adam Smith,1,132\n")
+
+
+class ImportJobTest(TestCase):
+    """Class testing imports done by background jobs"""
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media, IMPORT_CHUNK_SIZE=2)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media)
+        self.client.force_login(get_user_model().objects.create_user("planner"))
+
+    @staticmethod
+    def create_job(kind, name, content):
+        """Job of file saved in storage, as left by upload view"""
+        return ImportJob.objects.create(kind=kind, original_name=name,
+                                        file=default_storage.save(name, ContentFile(content)))
+
+    def test_run_import_job(self):
+        """Job imports file chunk by chunk and removes it once done"""
+        job = self.create_job(ImportJob.SCHEDULE, "schedule.csv", SCHEDULE)
+        run_import_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual((job.rows_processed, job.added, job.incorrect_count,
+                          job.duplicate_count), (5, 3, 1, 1))
+        self.assertEqual((job.incorrect, job.duplicate), ("1", "4"))
+        self.assertEqual(Lesson.objects.count(), 3)
+        self.assertFalse(default_storage.exists(job.file))
+
+    def test_resume_import_job(self):
+        """Failed job resumes after the last committed chunk"""
+        job = self.create_job(ImportJob.SCHEDULE, "schedule.csv", SCHEDULE)
+        parse_data = imp.parse_data
+        calls = []
+
+        def fail_second_chunk(data, ext):
+            calls.append(data.index[0])
+            if len(calls) == 2:
+                raise ValueError("Database is gone")
+            return parse_data(data, ext)
+
+        lessons_added = mock.Mock()
+        with mock.patch('scheduler.import_handlers.parse_data', side_effect=fail_second_chunk):
+            with self.assertRaises(ValueError):
+                run_import_job(job.id, lessons_added)
+            lessons_added.assert_called_once_with()
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.error), (ImportJob.FAILED, "Database is gone"))
+            self.assertEqual((job.rows_processed, job.added), (2, 1))
+            self.assertTrue(reset_failed_job(job))
+            run_import_job(job.id)
+        self.assertEqual(calls, [0, 2, 2, 4])
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual((job.rows_processed, job.added, job.incorrect_count,
+                          job.duplicate_count), (5, 3, 1, 1))
+        self.assertEqual(Lesson.objects.count(), 3)
+        self.assertFalse(reset_failed_job(job))
+
+    def test_job_claimed_once(self):
+        """Job already run by a retry of its task is neither run nor reset by resume"""
+        job = self.create_job(ImportJob.SCHEDULE, "schedule.csv", SCHEDULE)
+        ImportJob.objects.filter(pk=job.id).update(status=ImportJob.RUNNING,
+                                                   heartbeat=timezone.now())
+        run_import_job(job.id)
+        self.assertFalse(reset_failed_job(job))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_processed), (ImportJob.RUNNING, 0))
+        self.assertEqual(Lesson.objects.count(), 0)
+        response = self.client.post(reverse('resume_import', args=[job.id]))
+        self.assertRedirects(response, reverse('import_job', args=[job.id]))
+        self.assertEqual(ImportJob.objects.get(pk=job.id).status, ImportJob.RUNNING)
+        status = self.client.get(reverse('import_job_status', args=[job.id])).json()
+        self.assertFalse(status['stalled'])
+
+    @override_settings(IMPORT_RUNNING_TIMEOUT=60)
+    def test_stalled_job(self):
+        """Job whose worker died while running is resumed or claimed again by its task"""
+        job = self.create_job(ImportJob.SCHEDULE, "schedule.csv", SCHEDULE)
+        ImportJob.objects.filter(pk=job.id).update(
+            status=ImportJob.RUNNING, rows_processed=2, added=1,
+            heartbeat=timezone.now() - datetime.timedelta(hours=1))
+        status = self.client.get(reverse('import_job_status', args=[job.id])).json()
+        self.assertTrue(status['stalled'])
+        self.client.post(reverse('resume_import', args=[job.id]))
+        self.assertEqual(ImportJob.objects.get(pk=job.id).status, ImportJob.QUEUED)
+        ImportJob.objects.filter(pk=job.id).update(
+            status=ImportJob.RUNNING, heartbeat=timezone.now() - datetime.timedelta(hours=1))
+        run_import_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_processed), (ImportJob.DONE, 5))
+        self.assertEqual(Lesson.objects.count(), 2)
+
+    def test_resume_csv_after_parsed_rows(self):
+        """Resume skips parsed rows, blank lines and quoted line breaks don't shift it"""
+        content = ("Date,Start_time,End_time,Subject,Professor,Grupa,Auditorium\n"
+                   "11-05-19,12:00,13:30,First,John Doe,1,1.11a\n"
+                   "\n"
+                   "12-05-19,14:00,15:30,\"Two\nlines\",John Doe,3,2.41\n"
+                   "10-05-19,13:00,14:00,Third,Adam Smith,1,132\n"
+                   "31-05-19,20:00,22:00,Fourth,John Doe,2,2.41\n")
+        name = default_storage.save("schedule.csv", ContentFile(content))
+        chunks = list(imp.read_chunks(default_storage.path(name), '.csv', 2, start_row=1))
+        self.assertEqual([chunk.index.tolist() for chunk in chunks], [[1], [2, 3]])
+        self.assertEqual([subject for chunk in chunks for subject in chunk['Subject']],
+                         ["Two\nlines", "Third", "Fourth"])
+
+    def test_students_job(self):
+        """Students are imported by job as well"""
+        job = self.create_job(ImportJob.STUDENTS, "students.csv",
+                              "Index,Name,Group\n123456,John Doe,1\n12,Adam Smith,2\n"
+                              "234567,Adam Smith,2\n")
+        run_import_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.added, job.incorrect), (ImportJob.DONE, 2, "1"))
+        self.assertEqual(Student.objects.count(), 2)
+
+    def test_upload_starts_job(self):
+        """Big file is saved and imported by job instead of the request"""
+        upload = ContentFile(SCHEDULE, name="schedule.csv")
+        with override_settings(IMPORT_BACKGROUND_SIZE=10):
+            response = self.client.post(reverse('upload_schedule'), {'uploaded_file': upload})
+        job = ImportJob.objects.get()
+        self.assertRedirects(response, reverse('import_job', args=[job.id]))
+        self.assertEqual((job.status, job.kind), (ImportJob.QUEUED, ImportJob.SCHEDULE))
+        self.assertTrue(default_storage.exists(job.file))
+        self.assertEqual(Lesson.objects.count(), 0)
+        page = self.client.get(reverse('import_job', args=[job.id]))
+        self.assertContains(page, "schedule.csv")
+        status = self.client.get(reverse('import_job_status', args=[job.id])).json()
+        self.assertEqual((status['status'], status['rows_processed']), (ImportJob.QUEUED, 0))
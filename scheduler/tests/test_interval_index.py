@@ -0,0 +1,91 @@
+"""Tests of the in-process interval index of lessons"""
+import datetime
+
+from django.db import transaction
+from django.db.models import F
+from django.test import TransactionTestCase, override_settings
+
+from scheduler.conflicts_checker import are_overlapping, neighbours
+from scheduler.interval_index import get_index, overlapping, lessons_changed
+from scheduler.models import Lesson, Professor, Group, Room, ScheduleState
+from scheduler.synthetic import generate_lessons, save_to_database, University
+
+
+class IntervalIndexTestCase(TransactionTestCase):
+    """
+    Class testing lookups and invalidation of the interval index,
+    changes are committed as the index follows them on commit
+    """
+    def setUp(self):
+        self.room = Room.objects.create(number="1.11a")
+        self.lesson = Lesson.objects.create(
+            name="Lesson",
+            professor=Professor.objects.create(name="John", surname="Doe"),
+            room=self.room,
+            group=Group.objects.create(name="1"),
+            start_time=datetime.datetime(2019, 5, 11, 12, 00),
+            end_time=datetime.datetime(2019, 5, 11, 13, 30)
+        )
+        self.noon = datetime.datetime(2019, 5, 11, 12, 30)
+        self.evening = datetime.datetime(2019, 5, 11, 18, 00)
+
+    def test_overlapping(self):
+        """Test lookup of lessons of a room"""
+        self.assertEqual(overlapping(self.room, self.noon, self.evening), [self.lesson.id])
+        self.assertEqual(overlapping(self.room, self.evening, self.evening), [])
+        self.assertEqual(overlapping(self.lesson.group, self.noon, self.noon), [self.lesson.id])
+
+    def test_signals(self):
+        """Test saved and deleted lessons update the built index"""
+        get_index()
+        self.lesson.start_time = self.evening
+        self.lesson.end_time = self.evening + datetime.timedelta(hours=1)
+        self.lesson.save()
+        self.assertEqual(overlapping(self.room, self.noon, self.noon), [])
+        self.assertEqual(overlapping(self.room, self.evening, self.evening), [self.lesson.id])
+        self.lesson.delete()
+        self.assertEqual(overlapping(self.room, self.evening, self.evening), [])
+
+    def test_bulk_update(self):
+        """Test QuerySet.update() is seen after lessons_changed"""
+        get_index()
+        Lesson.objects.filter(id=self.lesson.id).update(room=Room.objects.create(number="2.01"))
+        lessons_changed([self.lesson.id])
+        self.assertEqual(overlapping(self.room, self.noon, self.noon), [])
+
+    def test_rolled_back_save(self):
+        """Test save rolled back is not applied to the index"""
+        get_index()
+        with self.assertRaises(ValueError), transaction.atomic():
+            self.lesson.start_time = self.evening
+            self.lesson.end_time = self.evening + datetime.timedelta(hours=1)
+            self.lesson.save()
+            raise ValueError("Rolled back")
+        self.assertEqual(overlapping(self.room, self.noon, self.noon), [self.lesson.id])
+        self.assertEqual(overlapping(self.room, self.evening, self.evening), [])
+
+    def test_changed_by_other_process(self):
+        """Test stale index is not rebuilt, lookups use windowed query until the interval ends"""
+        index = get_index()
+        version = index.version
+        Lesson.objects.filter(id=self.lesson.id).update(start_time=self.evening,
+                                                        end_time=self.evening)
+        ScheduleState.objects.update(version=F('version') + 1)
+        self.assertIsNone(get_index())
+        self.assertEqual(index.version, version)
+        self.assertEqual(overlapping(self.room, self.noon, self.noon), [])
+        self.assertEqual([lesson.id for lesson in neighbours(
+            [Lesson(room=self.room, start_time=self.evening, end_time=self.evening)], [])],
+                         [self.lesson.id])
+        with override_settings(INDEX_REBUILD_INTERVAL=0):
+            self.assertEqual(get_index().version, version + 1)
+
+    def test_same_as_scan(self):
+        """Test index finds the same lessons as checking every lesson"""
+        save_to_database(generate_lessons(University(10, 5, 5, 1), 150, 0.1, seed=4))
+        lessons = list(Lesson.objects.all())
+        for lesson in lessons[::7]:
+            self.assertEqual(
+                sorted(overlapping(lesson.room, lesson.start_time, lesson.end_time)),
+                sorted(other.id for other in lessons
+                       if other.room_id == lesson.room_id and are_overlapping(other, lesson)))
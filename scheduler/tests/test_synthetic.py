@@ -0,0 +1,48 @@
+"""Tests of synthetic schedule generator"""
+import datetime as dt
+import io
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from scheduler.conflicts_checker import find_conflicts
+from scheduler.import_handlers import import_csv, import_excel
+from scheduler.models import Lesson, ScheduleState
+from scheduler.synthetic import generate_lessons, to_csv_frame, to_excel_frame, \
+    save_to_database, University
+
+
+class SyntheticScheduleTestCase(TestCase):
+    """Tests for generate_lessons"""
+
+    def test_no_conflicts(self):
+        """Without conflict rate every lesson has its own professor, room and group"""
+        schedule = generate_lessons(University(20, 15, 15, 2), 300, seed=1)
+        self.assertEqual(len(schedule), 300)
+        self.assertEqual(save_to_database(schedule), 300)
+        self.assertEqual(find_conflicts(Lesson.objects.all()), [])
+
+    def test_conflicts(self):
+        """Conflict rate produces conflicting lessons"""
+        save_to_database(generate_lessons(University(20, 15, 15, 2), 300, 0.1, seed=1))
+        self.assertGreater(len(find_conflicts(Lesson.objects.all())), 0)
+
+    def test_seed(self):
+        """The same seed gives the same schedule"""
+        start = dt.date(2019, 5, 6)
+        self.assertEqual(generate_lessons(University(5, 5, 5, 1), 50, 0.1, start, seed=3),
+                         generate_lessons(University(5, 5, 5, 1), 50, 0.1, start, seed=3))
+
+    def test_import(self):
+        """Generated frames are accepted by import"""
+        schedule = generate_lessons(University(10, 10, 10, 1), 40, seed=2)
+        self.assertEqual(import_csv(to_csv_frame(schedule)), (40, [], []))
+        self.assertEqual(import_excel(to_excel_frame(schedule)), (0, [], list(range(40))))
+
+    def test_command_database(self):
+        """Lessons added by the command change schedule version and queue conflicts"""
+        call_command('generate_schedule', '--lessons', '30', '--conflict-rate', '0.1',
+                     '--seed', '1', '--database', stdout=io.StringIO())
+        self.assertEqual(Lesson.objects.count(), 30)
+        state = ScheduleState.load()
+        self.assertEqual((state.version, state.conflicts_status), (1, ScheduleState.QUEUED))
@@ -11,8 +11,12 @@ urlpatterns = [
     path('calendar/', views.index, name='index'),
     path('calendar/<str:date>', views.index_specific, name='index_specific'),
     path('conflicts/', views.show_conflicts, name='conflicts'),
+    path('conflicts/status/', views.conflicts_status, name='conflicts_status'),
     path('upload_schedule/', views.upload_schedule, name='upload_schedule'),
     path('upload_students/', views.upload_students, name='upload_students'),
+    path('import_jobs/<int:job_id>/', views.import_job, name='import_job'),
+    path('import_jobs/<int:job_id>/status/', views.import_job_status, name='import_job_status'),
+    path('import_jobs/<int:job_id>/resume/', views.resume_import, name='resume_import'),
     path('show_room_schedule/', views.show_rooms_schedule, name='show_room_schedule'),
     path('show_professors_schedule/', views.show_professors_schedule,
          name='show_professors_schedule'),
@@ -21,6 +25,7 @@ urlpatterns = [
     path('edit/<int:lesson_id>/', views.edit, name='edit'),
     path('remove/<int:lesson_id>/', views.remove, name='remove'),
     path('create/', views.create, name='create'),
+    path('check_conflicts/', views.check_conflicts, name='check_conflicts'),
     path('professors/', views.professors, name='professors'),
     path('delete_lessons/', views.delete_lessons, name='delete_lessons'),
     path('edit_lessons/', views.edit_lessons, name='edit_lessons'),
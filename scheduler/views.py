@@ -1,30 +1,41 @@
 """Views gathering point"""
 import os.path
 from datetime import datetime
+from typing import List, Tuple
 from wsgiref.util import FileWrapper
 
+import numpy as np
 import pandas as pd
 from django.contrib.auth import authenticate, login as log
-from django.core.files.storage import default_storage
 from django.conf import settings
-from django.http import HttpRequest, HttpResponse, HttpResponseRedirect
-from django.shortcuts import render, redirect
+from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse, \
+    StreamingHttpResponse
+from django.shortcuts import render, redirect, get_object_or_404
 from django.template import loader
 from django.utils.datastructures import MultiValueDictKeyError
-from xlrd import XLRDError
 
 
 import scheduler.import_handlers as imp
 from scheduler.calendar_util import get_start_date, generate_conflicts_context, \
     generate_full_schedule_context, generate_full_index_context_with_date, get_group_colors, \
     get_rooms_colors, generate_full_index_context, generate_context_for_conflicts_report
-from scheduler.conflicts_checker import db_conflicts, conflicts_diff
-from scheduler.model_util import get_professor, get_room, get_group
-from scheduler.models import Room, Lesson, Group, Conflict, Professor, Student
+from scheduler.conflicts_checker import update_conflicts_for, forecast_conflicts
+from scheduler.import_jobs import create_import_job, reset_failed_job, error_message, \
+    job_stalled
+from scheduler.model_util import get_professor, get_room, get_group, find_professor, \
+    find_room, find_group
+from scheduler.models import Room, Lesson, Group, Conflict, Professor, Student, ScheduleState, \
+    ImportJob, ImportedFile
+from scheduler.task import queue_conflicts_recompute, queue_import_file
 from scheduler.export_handlers import export_to_csv, export_to_excel
 from .forms import SelectRoomForm, SelectProfessorForm, SelectGroupForm, \
     EditForm, MassEditForm, LoginForm, ExportForm
 
+# files bigger than this are imported by a background job, unless IMPORT_BACKGROUND_SIZE is set
+DEFAULT_BACKGROUND_SIZE = 10 * 1024 * 1024
+
+# rows shown after import, unless IMPORT_PREVIEW_ROWS is set
+DEFAULT_PREVIEW_ROWS = 200
 
 
 def login(request: HttpRequest) -> HttpResponse:
@@ -65,88 +76,202 @@ def index_specific(_request: HttpRequest, date: str) -> HttpResponse:
     return render(_request, 'index.html', context)
 
 
+def in_background(file) -> bool:
+    """True if uploaded csv or xlsx file is big enough to be imported by a background job"""
+    return os.path.splitext(file.name)[1] in ('.csv', '.xlsx') \
+        and file.size > getattr(settings, 'IMPORT_BACKGROUND_SIZE', DEFAULT_BACKGROUND_SIZE)
+
+
+def import_preview(data: pd.DataFrame, incorrect: List[int], duplicate: List[int]) -> dict:
+    """
+    Context with summary of import and table of rows, incorrect in red and duplicate in blue
+    Files with more than IMPORT_PREVIEW_ROWS rows show only incorrect and duplicate rows,
+    at most IMPORT_PREVIEW_ROWS of them, so the page stays small for any file
+    """
+    limit = getattr(settings, 'IMPORT_PREVIEW_ROWS', DEFAULT_PREVIEW_ROWS)
+    incorrect_rows = data.index.isin(incorrect)
+    duplicate_rows = data.index.isin(duplicate)
+    colours = np.where(incorrect_rows, 'background: lightcoral',
+                       np.where(duplicate_rows, 'background: lightblue', ''))
+    errors_only = len(data) > limit
+    shown = incorrect_rows | duplicate_rows if errors_only else np.ones(len(data), dtype=bool)
+    rows = data[shown].iloc[:limit]
+    colours = colours[shown][:limit]
+    styles = pd.DataFrame(np.repeat(colours[:, None], len(rows.columns), axis=1),
+                          index=rows.index, columns=rows.columns)
+    table = rows.style \
+        .set_table_attributes('class="table table-striped table-hover table-bordered"') \
+        .apply(lambda _rows: styles, axis=None) \
+        .render()
+    return {'imported': True, 'loaded_data': table, 'rows_count': len(data),
+            'incorrect_count': len(incorrect), 'duplicate_count': len(duplicate),
+            'errors_only': errors_only, 'shown_count': len(rows),
+            'flagged_count': int(np.count_nonzero(incorrect_rows | duplicate_rows))}
+
+
+def identical_import(previous: ImportedFile) -> dict:
+    """Context of upload skipped, as it is identical to a file imported before"""
+    return {'imported': True, 'identical': previous, 'added': 0,
+            'rows_count': previous.rows, 'incorrect_count': previous.incorrect_count,
+            'duplicate_count': previous.rows - previous.incorrect_count}
+
+
+def forecast_preview(conflicts: List[imp.ImportConflict]) -> dict:
+    """
+    Context listing conflicts forecast by dry run, at most IMPORT_PREVIEW_ROWS of them
+    """
+    limit = getattr(settings, 'IMPORT_PREVIEW_ROWS', DEFAULT_PREVIEW_ROWS)
+    forecast = []
+    for c_type, row, other in conflicts[:limit]:
+        if isinstance(other, Lesson):
+            other = "{} on {:%Y-%m-%d %H:%M} in schedule".format(other.name, other.start_time)
+        else:
+            other = "row {}".format(other)
+        forecast.append("{} conflict: row {} with {}".format(c_type.capitalize(), row, other))
+    return {'forecast': forecast, 'forecast_count': len(conflicts)}
+
+
+def is_batch(files) -> bool:
+    """True if several files or zip archive were uploaded together"""
+    return len(files) > 1 or os.path.splitext(files[0].name)[1].lower() == '.zip'
+
+
+def batch_upload(files, dry_run: bool) -> dict:
+    """
+    Imports files uploaded together with import_batch and returns context with their summary
+    Files identical to ones imported before are skipped, conflicts are recomputed once
+    """
+    contents = imp.batch_files(files)
+    digests = [imp.content_digest(content) for _name, content in contents]
+    previous = [None if dry_run else imp.imported_before(digest) for digest in digests]
+    results = iter(imp.import_batch([file for file, before in zip(contents, previous)
+                                     if before is None], dry_run))
+    if not dry_run and None in previous:
+        queue_conflicts_recompute()
+    batch = []
+    for (name, _content), digest, before in zip(contents, digests, previous):
+        if before:
+            batch.append({'name': name, 'rows': before.rows, 'added': 0,
+                          'incorrect_count': before.incorrect_count,
+                          'duplicate_count': before.rows - before.incorrect_count,
+                          'error': "Identical to {} imported before".format(
+                              before.original_name)})
+            continue
+        name, rows, added, incorrect, duplicate, error = next(results)
+        batch.append({'name': name, 'rows': rows, 'added': added,
+                      'incorrect_count': len(incorrect), 'duplicate_count': len(duplicate),
+                      'error': error and error_message(error)})
+        if not dry_run and error is None:
+            imp.remember_import(digest, name, rows, len(incorrect))
+    return {'imported': True, 'batch': batch, 'added': sum(file['added'] for file in batch),
+            'dry_run': dry_run, 'conflicts_queued': not dry_run and None in previous}
+
+
 def upload_schedule(request: HttpRequest) -> HttpResponse:
     """Render schedule upload page"""
-    filename = None
     context: dict = {}
     try:
         if request.method == 'POST' and request.FILES['uploaded_file']:
             file = request.FILES['uploaded_file']
-            if isinstance(file.name, str):
-                filename = default_storage.save(file.name, file)
-
+            if is_batch(request.FILES.getlist('uploaded_file')):
+                context = batch_upload(request.FILES.getlist('uploaded_file'),
+                                       bool(request.POST.get('dry_run')))
+            elif isinstance(file.name, str) and request.POST.get('dry_run'):
+                # dry run is never queued, it saves nothing to resume
+                ext = os.path.splitext(file.name)[1]
+                data = imp.read_upload(file, ext)
+                added_lessons, incorrect, duplicate, conflicts = imp.forecast_import(data, ext)
+                context = import_preview(data, incorrect, duplicate)
+                context.update(forecast_preview(conflicts))
+                context.update({'added': added_lessons, 'dry_run': True})
+            elif isinstance(file.name, str):
+                digest = imp.file_digest(file)
+                previous = imp.imported_before(digest)
+                if previous:
+                    return render(request, "upload_schedule.html", identical_import(previous))
+                if in_background(file):
+                    job = create_import_job(ImportJob.SCHEDULE, file, digest)
+                    queue_import_file(job.id)
+                    return redirect('import_job', job_id=job.id)
                 ext = os.path.splitext(file.name)[1]
-                if ext == '.csv':
-                    data = pd.read_csv(file.name)
-                elif ext == '.xlsx':
-                    data = pd.read_excel(file.name)
-                else:
-                    return render(request, "upload_schedule.html",
-                                  {'error': "Error: Extension not supported"})
+                data = imp.read_upload(file, ext)
                 added_lessons, incorrect, duplicate = imp.parse_data(data, ext)
-                data_html = data.style \
-                    .set_table_attributes('class="table table-striped table-hover table-bordered"')\
-                    .apply(lambda x: [('background: lightcoral' if x.name in incorrect else
-                                       ('background: lightblue' if x.name in duplicate else ''))
-                                      for _ in x], axis=1) \
-                    .render()
-                db_conflicts()
-                context = {'loaded_data': data_html, 'added': added_lessons}
+                queue_conflicts_recompute()
+                imp.remember_import(digest, file.name, len(data), len(incorrect))
+                context = import_preview(data, incorrect, duplicate)
+                context.update({'added': added_lessons, 'conflicts_queued': True})
     except MultiValueDictKeyError:
         context = {'error': "Error: You didn't select a file"}
-    except XLRDError:
+    except imp.ImportCorruptedException:
         context = {'error': "Error: Corrupted file"}
     except UnicodeDecodeError:
         context = {'error': "Error: File contains weird symbols"}
     except imp.ImportSizeException:
         context = {'error': "Error: Incorrect number of columns"}
-    finally:
-        if filename:
-            default_storage.delete(filename)
+    except imp.ImportExtensionException:
+        context = {'error': "Error: Extension not supported"}
     return render(request, "upload_schedule.html", context)
 
 
 def upload_students(request: HttpRequest) -> HttpResponse:
     """Render students upload page"""
-    filename = None
     context: dict = {}
     try:
         if request.method == 'POST' and request.FILES['uploaded_file']:
             file = request.FILES['uploaded_file']
             if isinstance(file.name, str):
-                filename = default_storage.save(file.name, file)
-
+                dry_run = bool(request.POST.get('dry_run'))
+                if in_background(file) and not dry_run:
+                    job = create_import_job(ImportJob.STUDENTS, file)
+                    queue_import_file(job.id)
+                    return redirect('import_job', job_id=job.id)
                 ext = os.path.splitext(file.name)[1]
-                if ext == '.csv':
-                    data = pd.read_csv(file.name)
-                elif ext == '.xlsx':
-                    data = pd.read_excel(file.name)
-                else:
-                    return render(request, "upload_students.html",
-                                  {'error': "Error: Extension not supported"})
-                added_lessons, incorrect, duplicate = imp.import_students(data)
-                data_html = data.style \
-                    .set_table_attributes('class="table table-striped table-hover table-bordered"')\
-                    .apply(lambda x: [('background: lightcoral' if x.name in incorrect else
-                                       ('background: lightblue' if x.name in duplicate else ''))
-                                      for _ in x], axis=1) \
-                    .render()
-                db_conflicts()
-                context = {'loaded_data': data_html, 'added': added_lessons}
+                data = imp.read_upload(file, ext)
+                added_lessons, incorrect, duplicate = imp.import_students(data, dry_run)
+                # students never cause conflicts
+                context = import_preview(data, incorrect, duplicate)
+                context.update({'added': added_lessons, 'dry_run': dry_run})
     except MultiValueDictKeyError:
         context = {'error': "Error: You didn't select a file"}
-    except XLRDError:
+    except imp.ImportCorruptedException:
         context = {'error': "Error: Corrupted file"}
     except UnicodeDecodeError:
         context = {'error': "Error: File contains weird symbols"}
     except imp.ImportSizeException:
         context = {'error': "Error: Incorrect number of columns"}
-    finally:
-        if filename:
-            default_storage.delete(filename)
+    except imp.ImportExtensionException:
+        context = {'error': "Error: Extension not supported"}
     return render(request, "upload_students.html", context)
 
 
+def import_job(request: HttpRequest, job_id: int) -> HttpResponse:
+    """Render progress of background import, polling import_job_status"""
+    job = get_object_or_404(ImportJob, pk=job_id)
+    return render(request, "import_job.html", {'job': job})
+
+
+def import_job_status(_request: HttpRequest, job_id: int) -> JsonResponse:
+    """Return progress of background import"""
+    job = get_object_or_404(ImportJob, pk=job_id)
+    return JsonResponse({'status': job.status,
+                         'rows_processed': job.rows_processed,
+                         'added': job.added,
+                         'incorrect_count': job.incorrect_count,
+                         'incorrect': [int(row) for row in job.incorrect.split(',') if row],
+                         'duplicate_count': job.duplicate_count,
+                         'duplicate': [int(row) for row in job.duplicate.split(',') if row],
+                         'error': job.error,
+                         'stalled': job_stalled(job)})
+
+
+def resume_import(request: HttpRequest, job_id: int) -> HttpResponse:
+    """Queue failed or stalled background import again, from the last committed chunk"""
+    job = get_object_or_404(ImportJob, pk=job_id)
+    if request.method == 'POST' and reset_failed_job(job):
+        queue_import_file(job.id)
+    return redirect('import_job', job_id=job.id)
+
+
 def show_conflicts(request: HttpRequest) -> HttpResponse:
     """Render the conflicts page"""
     template = loader.get_template('conflicts.html')
@@ -154,6 +279,16 @@ def show_conflicts(request: HttpRequest) -> HttpResponse:
     return HttpResponse(template.render(context, request))
 
 
+def conflicts_status(_request: HttpRequest) -> JsonResponse:
+    """Return state of conflicts recomputation, polled while it is running"""
+    state = ScheduleState.load()
+    return JsonResponse({'status': state.conflicts_status,
+                         'progress': state.conflicts_progress,
+                         'version': state.version,
+                         'conflicts_version': state.conflicts_version,
+                         'up_to_date': state.conflicts_version == state.version})
+
+
 def show_rooms_schedule(request: HttpRequest) -> HttpResponse:
     """Render the room schedule page"""
     if request.method == 'POST':
@@ -288,8 +423,10 @@ def edit(request: HttpRequest, lesson_id) -> HttpResponse:
             lesson.group = get_group(form.cleaned_data['group'])
             lesson.start_time = form.cleaned_data['start_time']
             lesson.end_time = form.cleaned_data['end_time']
+            # edited lesson no longer matches the row it was imported from
+            lesson.source_hash = ''
             lesson.save()
-            db_conflicts()
+            update_conflicts_for([lesson.id])
             context = generate_full_index_context_with_date(form.cleaned_data['start_time'])
             current_conflicts = list(context['conflicts'])
             context.update(generate_context_for_conflicts_report(past_conflicts, current_conflicts))
@@ -318,7 +455,7 @@ def create(request: HttpRequest) -> HttpResponse:
             professor = get_professor(professor[0], professor[1])
             room = get_room(form.cleaned_data['room'])
             group = get_group(form.cleaned_data['group'])
-            Lesson.objects.get_or_create(
+            lesson, _created = Lesson.objects.get_or_create(
                 name=form.cleaned_data['name'],
                 professor=professor,
                 room=room,
@@ -326,7 +463,7 @@ def create(request: HttpRequest) -> HttpResponse:
                 start_time=form.cleaned_data['start_time'],
                 end_time=form.cleaned_data['end_time']
             )
-            db_conflicts()
+            update_conflicts_for([lesson.id])
             context = generate_full_index_context_with_date(form.cleaned_data['start_time'])
             current_conflicts = list(context['conflicts'])
             context.update(generate_context_for_conflicts_report(past_conflicts, current_conflicts))
@@ -342,7 +479,7 @@ def remove(request: HttpRequest, lesson_id) -> HttpResponse:
             past_conflicts = list(Conflict.objects.all())
             lesson = Lesson.objects.get(id=lesson_id)
             lesson.delete()
-            db_conflicts()
+            update_conflicts_for([lesson_id])
             context = generate_full_index_context()
             current_conflicts = list(context['conflicts'])
             context.update(generate_context_for_conflicts_report(past_conflicts, current_conflicts))
@@ -352,6 +489,62 @@ def remove(request: HttpRequest, lesson_id) -> HttpResponse:
         return redirect('/calendar/')
 
 
+def proposed_lessons(request: HttpRequest) -> Tuple[List[Lesson], dict]:
+    """
+    Lessons as they would be after submitting EditForm or MassEditForm (with checks[])
+    Nothing is written, resources which don't exist yet are left empty
+    :return: proposed lessons and errors of the form
+    """
+    if 'checks[]' not in request.POST:
+        form = EditForm(request.POST)
+        if not form.is_valid():
+            return [], form.errors
+        lesson = Lesson(id=form.cleaned_data['id'], name=form.cleaned_data['name'],
+                        start_time=form.cleaned_data['start_time'],
+                        end_time=form.cleaned_data['end_time'])
+        lessons = [lesson]
+        changes = form.cleaned_data
+    else:
+        form = MassEditForm(request.POST)
+        if not form.is_valid():
+            return [], form.errors
+        lessons = list(Lesson.objects.filter(id__in=request.POST.getlist('checks[]')))
+        changes = {field: value for field, value in form.cleaned_data.items() if value}
+    for lesson in lessons:
+        if 'professor' in changes:
+            professor = find_professor(*changes['professor'].strip().split())
+            lesson.professor_id = professor.id if professor else None
+        if 'room' in changes:
+            room = find_room(changes['room'])
+            lesson.room_id = room.id if room else None
+        if 'group' in changes:
+            group = find_group(changes['group'])
+            lesson.group_id = group.id if group else None
+        if 'start_time' in changes:
+            lesson.start_time = changes['start_time']
+        if 'end_time' in changes:
+            lesson.end_time = changes['end_time']
+    return lessons, {}
+
+
+def check_conflicts(request: HttpRequest) -> JsonResponse:
+    """Return conflicts the lessons from edit, create or mass edit form would be in"""
+    if request.method != 'POST':
+        return JsonResponse({'error': "POST lessons to check"}, status=405)
+    lessons, errors = proposed_lessons(request)
+    if errors:
+        return JsonResponse({'errors': errors, 'conflicts': []})
+    lessons = [lesson for lesson in lessons if lesson.start_time < lesson.end_time]
+    conflicts = [{'type': c_type,
+                  'lesson': lesson.name,
+                  'object': str(getattr(other, c_type.lower())),
+                  'other': {'id': other.id, 'name': other.name,
+                            'start_time': other.start_time.isoformat(timespec='minutes'),
+                            'end_time': other.end_time.isoformat(timespec='minutes')}}
+                 for c_type, lesson, other, _object_id in forecast_conflicts(lessons)]
+    return JsonResponse({'errors': {}, 'conflicts': conflicts})
+
+
 def is_ajax(request: HttpRequest) -> bool:
     return request.META.get('HTTP_X_REQUESTED_WITH', '').lower() == 'xmlhttprequest'
 
@@ -362,7 +555,7 @@ def delete_lessons(request: HttpRequest) -> HttpResponse:
         past_conflicts = list(Conflict.objects.all())
         checks = request.POST.getlist('checks[]')
         Lesson.objects.filter(id__in=checks).delete()
-        db_conflicts()
+        update_conflicts_for(checks)
         context = generate_full_index_context()
         current_conflicts = list(context['conflicts'])
         context.update(generate_context_for_conflicts_report(past_conflicts, current_conflicts))
@@ -394,10 +587,12 @@ def edit_lessons(request: HttpRequest) -> HttpResponse:
 
             checks = request.POST.getlist('checks[]')
             if changes != {}:
+                # edited lessons no longer match rows they were imported from
+                changes['source_hash'] = ''
                 lessons = Lesson.objects.filter(id__in=checks)
                 lessons.update(**changes)
+                update_conflicts_for(checks)
 
-            db_conflicts()
             context_after_edit = generate_full_index_context()
             current_conflicts = list(context_after_edit['conflicts'])
             context_after_edit.update(
@@ -459,18 +654,20 @@ def export(request: HttpRequest) -> HttpResponse:
                 return render(request, 'popup.html', context={"form": form, "export": True})
             if form.cleaned_data["start_time"] and form.cleaned_data["end_time"] and \
                     form.cleaned_data["file_format"] == "csv":
-                temp_file = export_to_csv(form.cleaned_data["start_time"],
-                                          form.cleaned_data["end_time"])
+                # streamed line by line, nothing is written to disk
+                response = StreamingHttpResponse(export_to_csv(form.cleaned_data["start_time"],
+                                                               form.cleaned_data["end_time"]),
+                                                 content_type='text/csv')
                 file_name = 'schedule.csv'
             elif form.cleaned_data["start_time"] and form.cleaned_data["end_time"] and \
                     form.cleaned_data["file_format"] == "excel":
                 temp_file = export_to_excel(form.cleaned_data["start_time"],
                                             form.cleaned_data["end_time"])
                 file_name = 'schedule.xlsx'
+                wrapper = FileWrapper(temp_file)
+                response = HttpResponse(wrapper, content_type='application/vnd.ms-excel')
             else:
                 return render(request, 'popup.html', context={"form": form, "export": True})
-            wrapper = FileWrapper(temp_file)
-            response = HttpResponse(wrapper, content_type='application/vnd.ms-excel')
             response['Content-Disposition'] = 'attachment; filename=' + file_name
             return response
         return render(request, 'popup.html', context={"form": form, "export": True})
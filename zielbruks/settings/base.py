@@ -145,3 +145,51 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_BEAT_SCHEDULER = 'djcelery.schedulers.DatabaseScheduler'
+
+# Number of conflicts inserted into database with a single query
+CONFLICTS_BATCH_SIZE = 500
+
+# Engine finding all conflicts: 'python' sweeps lessons in memory,
+# 'sql' finds them with a single INSERT ... SELECT query,
+# 'numpy' works on columns of lessons and is the fastest for very large schedules,
+# 'parallel' splits lessons by professor, room and group between CONFLICTS_WORKERS processes
+CONFLICTS_ENGINE = 'python'
+
+# Number of processes used by 'parallel' conflicts engine, None means number of CPUs
+CONFLICTS_WORKERS = None
+
+# Conflicts are recomputed after schedule has not changed for this many seconds,
+# or sooner when they are read
+CONFLICTS_RECOMPUTE_DELAY = 5
+
+# Running recomputation of conflicts which has not reported progress for this many seconds
+# is taken as dead, its worker stopped, and is started again
+CONFLICTS_RUNNING_TIMEOUT = 30 * 60
+
+# Seconds between builds of the interval index of lessons made stale by changes
+# from another process, meanwhile lessons are looked up with windowed queries
+INDEX_REBUILD_INTERVAL = 60
+
+# Seconds for which calendar events of a schedule version are cached
+SCHEDULE_CACHE_TIMEOUT = 300
+
+# Number of imported lessons inserted into database with a single query
+IMPORT_BATCH_SIZE = 1000
+
+# Files bigger than this many bytes are imported by a background job
+# in chunks of IMPORT_CHUNK_SIZE rows, without showing their content
+IMPORT_BACKGROUND_SIZE = 10 * 1024 * 1024
+IMPORT_CHUNK_SIZE = 10000
+
+# Running import job which has not committed a chunk for this many seconds is taken
+# as stalled, its worker died, and can be resumed
+IMPORT_RUNNING_TIMEOUT = 30 * 60
+
+# Rows shown after import, bigger files show only their incorrect and duplicate rows
+IMPORT_PREVIEW_ROWS = 200
+
+# Number of processes parsing files of batch upload, None means number of CPUs
+IMPORT_WORKERS = None
+
+# Lessons fetched from database at once while csv export is streamed
+EXPORT_CHUNK_SIZE = 2000